@@ -18,8 +18,35 @@ import platform
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 from datetime import datetime
+from contextlib import contextmanager
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, namedtuple
+from collections.abc import Mapping
 import itertools  # para animação suave
+import gc
+import tracemalloc
+import random
+import glob
+import base64
+import queue
+import signal
+import shutil
+import tempfile
+import http.server
+import http.cookiejar
+import select
+import traceback
+
+try:
+    from mutagen.id3 import ID3, ID3NoHeaderError, APIC, TIT2, TPE1, TALB, TDRC, TRCK, TCON, TSRC
+    from mutagen.mp4 import MP4, MP4Cover
+    from mutagen.oggopus import OggOpus
+    from mutagen.oggvorbis import OggVorbis
+    from mutagen.flac import FLAC, Picture
+    HAS_MUTAGEN = True
+except ImportError:  # sem mutagen as tags voltam a ser gravadas pelo ffmpeg do yt-dlp
+    HAS_MUTAGEN = False
 
 # ---------- CONFIGURAÇÃO DE LOG ----------
 import logging
@@ -45,7 +72,20 @@ DEFAULT_CONFIG = {
     "download_dir": str(DOWN_DIR),
     "media_type": "audio",
     "video_quality": "best",
-    "audio_quality": "0"
+    "audio_quality": "0",
+    "stream_play": False,
+    "playlist_workers": 3,
+    "video_backend": "ytdlp",
+    "segments": 4,
+    "stall_timeout": 90,
+    "smart_format": True,
+    "staging": False,
+    "staging_batch": 25,
+    "job_budget": 1800,
+    "trace": False,
+    "background_jobs": True,
+    "job_workers": 2,
+    "player": "auto"
 }
 
 # ---------- CREDENCIAIS SPOTIFY ----------
@@ -66,22 +106,51 @@ class Color:
     RESET = '\033[0m'
     BOLD = '\033[1m'
 
+# Job em execução na thread atual (None = primeiro plano)
+JOB_CONTEXT = threading.local()
+
+def current_job():
+    return getattr(JOB_CONTEXT, "job", None)
+
+def set_current_job(job):
+    JOB_CONTEXT.job = job
+
+class JobCancelled(BaseException):
+    """O job foi interrompido na saída do programa.
+
+    Deriva de BaseException (como KeyboardInterrupt) para atravessar os
+    `except Exception` dos downloads até o JobScheduler.
+    """
+
+def job_thread_pool(max_workers: int) -> ThreadPoolExecutor:
+    """ThreadPoolExecutor cujas threads herdam o job atual (logs e progresso)"""
+    return ThreadPoolExecutor(max_workers=max(1, max_workers), initializer=set_current_job,
+                              initargs=(current_job(),))
+
 class TermuxLogger:
+    @staticmethod
+    def _write(text: str):
+        # Dentro de um job a mensagem vai para o log dele, não para o terminal
+        if job := current_job():
+            job.log(text)
+        else:
+            print(text, file=sys.stderr)
+
     @staticmethod
     def info(message: str):
-        print(f"{Color.CYAN}▪ {message}{Color.RESET}", file=sys.stderr)
+        TermuxLogger._write(f"{Color.CYAN}▪ {message}{Color.RESET}")
     
     @staticmethod
     def success(message: str):
-        print(f"{Color.GREEN}✅ {message}{Color.RESET}", file=sys.stderr)
+        TermuxLogger._write(f"{Color.GREEN}✅ {message}{Color.RESET}")
     
     @staticmethod
     def warning(message: str):
-        print(f"{Color.YELLOW}⚠ {message}{Color.RESET}", file=sys.stderr)
+        TermuxLogger._write(f"{Color.YELLOW}⚠ {message}{Color.RESET}")
     
     @staticmethod
     def error(message: str):
-        print(f"{Color.RED}❌ {message}{Color.RESET}", file=sys.stderr)
+        TermuxLogger._write(f"{Color.RED}❌ {message}{Color.RESET}")
 
 def sanitize_filename(name: str) -> str:
     """Remove caracteres inválidos para nomes de arquivo"""
@@ -156,6 +225,11 @@ class SmoothProgress:
         self.percent = 0.0
         self.done = False
         self.spinner = itertools.cycle('⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏')
+        self.thread = None
+        self.job = current_job()
+        if self.job:
+            # A tela de jobs lê percent/title daqui
+            self.job.progress = self
 
     def update(self, line: str):
         if "[download]" in line:
@@ -170,6 +244,8 @@ class SmoothProgress:
         print('\r' + ' ' * 60 + '\r', end='', flush=True)
 
     def start(self):
+        if self.job:
+            return
         self.thread = threading.Thread(target=self._loop, daemon=True)
         self.thread.start()
 
@@ -178,16 +254,195 @@ class SmoothProgress:
         if self.thread:
             self.thread.join(timeout=1)
 
+# ---------- TRACE DA EXECUÇÃO (CHROME TRACE EVENTS) ----------
+TRACE_DIR = SCRIPT_DIR / "traces"
+
+# Prefixos da saída do yt-dlp -> etapa da timeline
+YTDLP_PHASES = [
+    ("[download]", "transfer"),
+    ("[ExtractAudio]", "postprocess"),
+    ("[Merger]", "postprocess"),
+    ("[EmbedThumbnail]", "postprocess"),
+    ("[Metadata]", "postprocess"),
+    ("[Fixup", "postprocess"),
+    ("[ThumbnailsConvertor]", "postprocess"),
+    ("[MoveFiles]", "postprocess"),
+]
+
+class Tracer:
+    """Coleta spans por thread e grava no formato trace-event do Chrome/Perfetto"""
+    def __init__(self):
+        self.enabled = False
+        self.events: List[Dict[str, Any]] = []
+        self.lanes: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    def _lane(self) -> int:
+        ident = threading.get_ident()
+        if ident not in self.lanes:
+            self.lanes[ident] = len(self.lanes) + 1
+            self.events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(),
+                                "tid": self.lanes[ident], "args": {"name": threading.current_thread().name}})
+        return self.lanes[ident]
+
+    def add(self, name: str, cat: str, start: float, end: float, **args):
+        """Registra um span já medido (timestamps de perf_counter)"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.events.append({
+                "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": self._lane(),
+                "ts": round((start - self.origin) * 1e6), "dur": round((end - start) * 1e6),
+                "args": args
+            })
+
+    @contextmanager
+    def span(self, name: str, cat: str, **args):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, cat, start, self.now(), **args)
+
+    def sleep(self, seconds: float, reason: str = "tick"):
+        with self.span("sleep", "sleep", reason=reason):
+            time.sleep(seconds)
+
+    def save(self) -> Optional[Path]:
+        if not self.enabled or not self.events:
+            return None
+        path = ensure_directory(TRACE_DIR) / f"rimusic-{datetime.now():%Y%m%d-%H%M%S}.json"
+        with self.lock:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+            self.events = []
+            self.lanes = {}
+        return path
+
+TRACER = Tracer()
+
 # ---------- CLIENTE SPOTIFY ----------
+SPOTIFY_API = "https://api.spotify.com/v1"
+
+class TrackRecord(Mapping):
+    """Metadados de uma track com __slots__ e strings repetidas internadas.
+
+    Playlists grandes repetem artista, álbum, data e URL da capa em milhares de
+    tracks; aqui cada string distinta existe uma vez só. Continua sendo lida como
+    o dicionário de antes (record["name"], record.get("genre"), dict(record)).
+    """
+    __slots__ = ("id", "isrc", "name", "artist", "album", "track_number",
+                 "track_count", "date", "genre", "cover_url")
+    KEYS = __slots__ + ("search",)
+
+    def __init__(self, name: str, artist: str, album: str, track_number: int, track_count: int,
+                 date: str, genre: str = "", cover_url: Optional[str] = None,
+                 id: Optional[str] = None, isrc: Optional[str] = None, search: Optional[str] = None):
+        self.id = id
+        self.isrc = isrc
+        self.name = name
+        self.artist = sys.intern(artist)
+        self.album = sys.intern(album)
+        self.track_number = track_number
+        self.track_count = track_count
+        self.date = sys.intern(date)
+        self.genre = sys.intern(genre)
+        self.cover_url = sys.intern(cover_url) if cover_url else None
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "TrackRecord":
+        return cls(**{key: data[key] for key in cls.KEYS if key in data and key != "search"})
+
+    @property
+    def search(self) -> str:
+        # Derivado em vez de guardado: economiza uma string por track
+        return f"{self.artist} - {self.name}"
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self) -> int:
+        return len(self.KEYS)
+
+    def __repr__(self) -> str:
+        return f"TrackRecord({self.search!r})"
+
+def track_to_metadata(track: Dict[str, Any], album: Optional[Dict[str, Any]] = None) -> TrackRecord:
+    """Converte um objeto track da API no registro de metadados usado no download"""
+    album = album or track["album"]
+    return TrackRecord(
+        id=track.get("id"),
+        isrc=track.get("external_ids", {}).get("isrc"),
+        name=track["name"],
+        artist=", ".join(artist["name"] for artist in track["artists"]),
+        album=album["name"],
+        track_number=track["track_number"],
+        track_count=album["total_tracks"],
+        date=album["release_date"],
+        genre=";".join(album.get("genres", [])),
+        cover_url=album["images"][0]["url"] if album.get("images") else None
+    )
+
+def benchmark_track_memory(count: int = 10000):
+    """Compara bytes por track: dicionário simples x TrackRecord"""
+    albums = max(1, count // 12)
+    payload = json.dumps({"items": [{"track": {
+        "id": f"{i:022d}", "name": f"Faixa {i}", "track_number": i % 12 + 1,
+        "external_ids": {"isrc": f"BR{i:010d}"},
+        "artists": [{"name": f"Artista {i % albums % 97}"}],
+        "album": {"name": f"Álbum {i % albums}", "total_tracks": 12, "release_date": "2021-05-14",
+                  "genres": [], "images": [{"url": f"https://i.scdn.co/image/ab67616d0000b273{i % albums:024x}"}]},
+    }} for i in range(count)]})
+
+    def legacy(track: Dict[str, Any]) -> Dict[str, Any]:
+        artists = ", ".join(artist["name"] for artist in track["artists"])
+        return {
+            "name": track["name"], "artist": artists, "album": track["album"]["name"],
+            "track_number": track["track_number"], "track_count": track["album"]["total_tracks"],
+            "date": track["album"]["release_date"], "genre": ";".join(track["album"].get("genres", [])),
+            "search": f"{artists} - {track['name']}",
+            "cover_url": track["album"]["images"][0]["url"] if track["album"].get("images") else None
+        }
+
+    results = {}
+    for label, build in (("dict", legacy), ("TrackRecord", track_to_metadata)):
+        gc.collect()
+        tracemalloc.start()
+        # Cada página da API vira objetos novos; só o que a track guarda continua vivo
+        items = json.loads(payload)["items"]
+        tracks = [build(item["track"]) for item in items]
+        del items
+        gc.collect()
+        results[label] = tracemalloc.get_traced_memory()[0] / count
+        tracemalloc.stop()
+        del tracks
+    print(f"\n{Color.BOLD}Memória por track ({count} tracks, {albums} álbuns){Color.RESET}")
+    for label, per_track in results.items():
+        print(f"{label:<12} {per_track:>8.0f} bytes")
+    print(f"{'redução':<12} {100 * (1 - results['TrackRecord'] / results['dict']):>7.0f}%")
+
 def get_spotify_token() -> Optional[str]:
     """Obtém token de acesso do Spotify"""
     try:
-        response = requests.post(
-            "https://accounts.spotify.com/api/token",
-            data={"grant_type": "client_credentials"},
-            auth=(SPOTIFY_CREDS["client_id"], SPOTIFY_CREDS["client_secret"]),
-            timeout=15
-        )
+        with TRACER.span("auth", "spotify"):
+            response = requests.post(
+                "https://accounts.spotify.com/api/token",
+                data={"grant_type": "client_credentials"},
+                auth=(SPOTIFY_CREDS["client_id"], SPOTIFY_CREDS["client_secret"]),
+                timeout=15
+            )
         response.raise_for_status()
         return response.json()["access_token"]
     except Exception as e:
@@ -204,60 +459,39 @@ def search_spotify_track(query: str, token: str) -> Optional[Dict[str, Any]]:
             "limit": 1,
             "market": "US"
         }
-        response = requests.get(
-            "https://api.spotify.com/v1/search",
-            headers=headers,
-            params=params,
-            timeout=15
-        )
+        with TRACER.span("search", "spotify", query=query):
+            response = requests.get(
+                f"{SPOTIFY_API}/search",
+                headers=headers,
+                params=params,
+                timeout=15
+            )
         response.raise_for_status()
         data = response.json()
         items = data["tracks"]["items"]
         if not items:
             return None
-        track = items[0]
-        artists = ", ".join(artist["name"] for artist in track["artists"])
-        return {
-            "name": track["name"],
-            "artist": artists,
-            "album": track["album"]["name"],
-            "track_number": track["track_number"],
-            "track_count": track["album"]["total_tracks"],
-            "date": track["album"]["release_date"],
-            "genre": ";".join(track["album"].get("genres", [])),
-            "search": f"{artists} - {track['name']}",
-            "cover_url": track["album"]["images"][0]["url"] if track["album"].get("images") else None
-        }
+        return track_to_metadata(items[0])
     except Exception as e:
         TermuxLogger.error(f"Erro na busca Spotify: {e}")
         return None
 
-def get_spotify_playlist_tracks(playlist_id: str, token: str) -> List[Dict[str, Any]]:
+def get_spotify_playlist_tracks(playlist_id: str, token: str) -> List[TrackRecord]:
     """Obtém todas as tracks de uma playlist do Spotify"""
     tracks = []
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
+    url = f"{SPOTIFY_API}/playlists/{playlist_id}/tracks"
     try:
         headers = {"Authorization": f"Bearer {token}"}
         params = {"limit": 50, "market": "US"}
         while url:
-            response = requests.get(url, headers=headers, params=params, timeout=15)
+            with TRACER.span("playlist page", "spotify", url=url):
+                response = requests.get(url, headers=headers, params=params, timeout=15)
             response.raise_for_status()
             data = response.json()
             for item in data["items"]:
                 track = item["track"]
                 if track and track["type"] == "track":
-                    artists = ", ".join(artist["name"] for artist in track["artists"])
-                    tracks.append({
-                        "name": track["name"],
-                        "artist": artists,
-                        "album": track["album"]["name"],
-                        "track_number": track["track_number"],
-                        "track_count": track["album"]["total_tracks"],
-                        "date": track["album"]["release_date"],
-                        "genre": ";".join(track["album"].get("genres", [])),
-                        "search": f"{artists} - {track['name']}",
-                        "cover_url": track["album"]["images"][0]["url"] if track["album"].get("images") else None
-                    })
+                    tracks.append(track_to_metadata(track))
             url = data.get("next")
             params = None
     except Exception as e:
@@ -275,21 +509,794 @@ def extract_spotify_playlist_id(url: str) -> Optional[str]:
             return match.group(1)
     return None
 
+# ---------- RESOLUÇÃO EM LOTE DE LINKS SPOTIFY ----------
+SPOTIFY_URL_RE = re.compile(
+    r'(?:open\.spotify\.com/(?:intl-[a-z]+/)?|spotify:)(track|album|artist)[/:]([a-zA-Z0-9]{22})'
+)
+
+# Limites dos endpoints multi-ID da API (/tracks aceita 50, /albums apenas 20)
+SPOTIFY_BATCH_LIMITS = {"tracks": 50, "albums": 20}
+
+def parse_spotify_url(item: str) -> Optional[tuple]:
+    """Retorna (tipo, id) para links/URIs de track, álbum ou artista do Spotify"""
+    if match := SPOTIFY_URL_RE.search(item):
+        return match.group(1), match.group(2)
+    return None
+
+def spotify_get(url: str, token: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """GET na API do Spotify respeitando o Retry-After em caso de 429"""
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(3):
+        with TRACER.span("api", "spotify", url=url):
+            response = requests.get(url, headers=headers, params=params, timeout=15)
+        if response.status_code == 429:
+            TRACER.sleep(int(response.headers.get("Retry-After", "1")) + 1, "spotify 429")
+            continue
+        response.raise_for_status()
+        return response.json()
+    response.raise_for_status()
+    return response.json()
+
+def spotify_get_several(kind: str, ids: List[str], token: str, workers: int = 1) -> List[Dict[str, Any]]:
+    """Busca vários objetos por ID usando os endpoints multi-ID em lotes"""
+    size = SPOTIFY_BATCH_LIMITS[kind]
+    batches = [ids[start:start + size] for start in range(0, len(ids), size)]
+
+    def fetch(batch: List[str]) -> List[Dict[str, Any]]:
+        try:
+            data = spotify_get(f"{SPOTIFY_API}/{kind}", token, {"ids": ",".join(batch), "market": "US"})
+            return [obj for obj in data[kind] if obj]
+        except Exception as e:
+            TermuxLogger.error(f"Erro ao resolver lote de {kind}: {e}")
+            return []
+
+    with job_thread_pool(max(1, workers)) as pool:
+        return [obj for objects in pool.map(fetch, batches) for obj in objects]
+
+def get_spotify_album_tracks(album: Dict[str, Any], token: str) -> List[Dict[str, Any]]:
+    """Tracks de um objeto álbum completo, paginando além das primeiras 50"""
+    page = album["tracks"]
+    items = list(page["items"])
+    while page.get("next"):
+        page = spotify_get(page["next"], token)
+        items.extend(page["items"])
+    return [track_to_metadata(track, album) for track in items if track]
+
+def get_spotify_artist_top_tracks(artist_id: str, token: str) -> List[Dict[str, Any]]:
+    """Top tracks de um artista (a API não oferece versão multi-ID)"""
+    data = spotify_get(f"{SPOTIFY_API}/artists/{artist_id}/top-tracks", token, {"market": "US"})
+    return [track_to_metadata(track) for track in data["tracks"]]
+
+def resolve_spotify_urls(items: List[str], token: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Resolve links do Spotify em lote; retorna {item: [metadados, ...]}"""
+    refs = {item: ref for item in items if (ref := parse_spotify_url(item))}
+    track_ids = list(dict.fromkeys(i for kind, i in refs.values() if kind == "track"))
+    album_ids = list(dict.fromkeys(i for kind, i in refs.values() if kind == "album"))
+    resolved: Dict[tuple, List[Dict[str, Any]]] = {}
+    for track in spotify_get_several("tracks", track_ids, token):
+        resolved[("track", track["id"])] = [track_to_metadata(track)]
+    for album in spotify_get_several("albums", album_ids, token):
+        try:
+            resolved[("album", album["id"])] = get_spotify_album_tracks(album, token)
+        except Exception as e:
+            TermuxLogger.error(f"Erro no álbum {album.get('name')}: {e}")
+    for kind, artist_id in dict.fromkeys(refs.values()):
+        if kind == "artist":
+            try:
+                resolved[(kind, artist_id)] = get_spotify_artist_top_tracks(artist_id, token)
+            except Exception as e:
+                TermuxLogger.error(f"Erro no artista {artist_id}: {e}")
+    return {item: resolved.get(ref, []) for item, ref in refs.items()}
+
+# ---------- DISCOGRAFIA ----------
+SPOTIFY_RESOLVE_WORKERS = 8
+
+def get_spotify_artist_album_ids(artist_id: str, token: str) -> List[str]:
+    """Pagina todos os álbuns e singles de um artista"""
+    album_ids = []
+    url = f"{SPOTIFY_API}/artists/{artist_id}/albums"
+    params = {"include_groups": "album,single", "limit": 50, "market": "US"}
+    while url:
+        data = spotify_get(url, token, params)
+        album_ids.extend(album["id"] for album in data["items"])
+        url = data.get("next")
+        params = None
+    return list(dict.fromkeys(album_ids))
+
+def get_spotify_discography(artist_id: str, token: str) -> List[Dict[str, Any]]:
+    """Resolve a discografia completa, sem duplicatas entre edições (por ISRC)"""
+    album_ids = get_spotify_artist_album_ids(artist_id, token)
+    TermuxLogger.info(f"{len(album_ids)} lançamentos encontrados, resolvendo tracklists...")
+    albums = spotify_get_several("albums", album_ids, token, SPOTIFY_RESOLVE_WORKERS)
+    # Edições originais primeiro: a deluxe só contribui com as faixas bônus
+    albums.sort(key=lambda album: album.get("release_date", ""))
+    def album_tracks(album: Dict[str, Any]) -> List[Dict[str, Any]]:
+        try:
+            return get_spotify_album_tracks(album, token)
+        except Exception as e:
+            TermuxLogger.error(f"Erro no álbum {album.get('name')}: {e}")
+            return []
+
+    with job_thread_pool(SPOTIFY_RESOLVE_WORKERS) as pool:
+        tracklists = list(pool.map(album_tracks, albums))
+    track_ids = list(dict.fromkeys(track["id"] for tracks in tracklists for track in tracks if track["id"]))
+    # Os objetos simplificados não trazem ISRC; /tracks em lote traz
+    full_tracks = spotify_get_several("tracks", track_ids, token, SPOTIFY_RESOLVE_WORKERS)
+    by_id = {track["id"]: track for track in full_tracks}
+    tracks = []
+    seen = set()
+    for track_id in track_ids:
+        if track_id not in by_id:
+            continue
+        metadata = track_to_metadata(by_id[track_id])
+        key = metadata["isrc"] or metadata["search"].lower()
+        if key not in seen:
+            seen.add(key)
+            tracks.append(metadata)
+    return tracks
+
+# ---------- CLASSIFICAÇÃO DE FALHAS ----------
+class Failure:
+    NETWORK = "network"
+    RATE_LIMITED = "rate_limited"
+    UNAVAILABLE = "unavailable"
+    NOT_FOUND = "not_found"
+    STALLED = "stalled"
+    UNKNOWN = "unknown"
+
+FAILURE_LABELS = {
+    Failure.NETWORK: "rede",
+    Failure.RATE_LIMITED: "limite de taxa",
+    Failure.UNAVAILABLE: "indisponível",
+    Failure.NOT_FOUND: "não encontrado",
+    Failure.STALLED: "travado",
+    Failure.UNKNOWN: "desconhecido",
+}
+
+# A ordem importa: "HTTP Error 429" e bloqueios vencem erros genéricos de rede
+FAILURE_SIGNATURES = [
+    (Failure.RATE_LIMITED, re.compile(
+        r"HTTP Error 429|Too Many Requests|rate[- ]?limit|confirm you.re not a bot", re.I)),
+    (Failure.UNAVAILABLE, re.compile(
+        r"Private video|Video unavailable|This video is unavailable|not (?:made )?available in your country|"
+        r"geo[- ]?restrict|blocked it in your country|members[- ]only|removed by the uploader|"
+        r"account associated with this video has been terminated|copyright claim|confirm your age", re.I)),
+    (Failure.NOT_FOUND, re.compile(
+        r"HTTP Error 404|Unsupported URL|is not a valid URL|No video results|"
+        r"Requested format is not available|no suitable formats", re.I)),
+    (Failure.NETWORK, re.compile(
+        r"timed out|Connection (?:reset|refused|aborted)|Temporary failure in name resolution|"
+        r"Name or service not known|Network is unreachable|No route to host|RemoteDisconnected|"
+        r"IncompleteRead|HTTP Error 5\d\d|SSLError|EOF occurred", re.I)),
+]
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+RATE_LIMIT_COOLDOWN = 90.0
+REQUEUE_LIMIT = 2
+
+def classify_failure(output: str) -> str:
+    """Classifica a falha do yt-dlp pela saída (ERROR: ...)"""
+    for kind, pattern in FAILURE_SIGNATURES:
+        if pattern.search(output):
+            return kind
+    return Failure.UNKNOWN
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial com jitter completo"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+class RunSummary:
+    """Resumo de uma execução: sucessos, falhas por classe e eventos"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.success = 0
+        self.failures: Dict[str, int] = {}
+        self.events: List[str] = []
+        self.cpu_copied: List[float] = []
+        self.cpu_transcoded: List[float] = []
+
+    def record(self, status: str):
+        with self.lock:
+            if status == "ok":
+                self.success += 1
+            else:
+                self.failures[status] = self.failures.get(status, 0) + 1
+
+    def event(self, message: str):
+        with self.lock:
+            self.events.append(message)
+
+    def record_cpu(self, copied: bool, seconds: float):
+        with self.lock:
+            (self.cpu_copied if copied else self.cpu_transcoded).append(seconds)
+
+    def cpu_saved(self) -> Optional[float]:
+        """CPU economizada pelas tracks que não foram re-encodadas.
+
+        Só é calculada quando a execução mediu os dois casos (cópia e re-encode);
+        sem amostra de re-encode retorna None.
+        """
+        if not self.cpu_copied or not self.cpu_transcoded:
+            return None
+        copied_avg = sum(self.cpu_copied) / len(self.cpu_copied)
+        transcode_avg = sum(self.cpu_transcoded) / len(self.cpu_transcoded)
+        return max(0.0, transcode_avg - copied_avg) * len(self.cpu_copied)
+
+    def show(self, total: int):
+        TermuxLogger.success(f"Concluído: {self.success}/{total} músicas")
+        if self.failures:
+            details = ", ".join(f"{count} {FAILURE_LABELS.get(kind, kind)}"
+                                for kind, count in sorted(self.failures.items()))
+            TermuxLogger.warning(f"Falhas: {details}")
+        if self.cpu_copied:
+            saved = self.cpu_saved()
+            TermuxLogger.info(f"Formato inteligente: {len(self.cpu_copied)} sem re-encode, "
+                              + (f"~{saved:.0f}s de CPU economizados" if saved is not None
+                                 else "CPU economizada: n/a (nenhuma faixa re-encodada para comparar)"))
+        for message in self.events:
+            TermuxLogger.info(message)
+
+# ---------- FORMATO INTELIGENTE (SEM RE-ENCODE) ----------
+# Codec de origem que o ffmpeg pode apenas copiar para cada formato pedido
+TARGET_CODECS = {"opus": "opus", "m4a": "aac", "mp3": "mp3"}
+FORMAT_SELECTORS = {
+    "opus": "bestaudio[acodec=opus]/bestaudio",
+    "m4a": "bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio",
+    "mp3": "bestaudio[acodec=mp3]/bestaudio",
+}
+# Formatos de áudio do YouTube (itag -> codec)
+YOUTUBE_AUDIO_ITAGS = {"249": "opus", "250": "opus", "251": "opus",
+                       "139": "aac", "140": "aac", "141": "aac"}
+SELECTED_FORMAT_RE = re.compile(r'Downloading \d+ format\(s\): (\S+)')
+
+def audio_format_args(config: Dict[str, Any]) -> List[str]:
+    """Seleciona a fonte cujo codec já é o pedido, para o ffmpeg só copiar"""
+    if not config.get("smart_format", True):
+        return []
+    return ["--format", FORMAT_SELECTORS.get(config["format"], "bestaudio/best")]
+
+def is_stream_copy(output: str, config: Dict[str, Any]) -> bool:
+    """Verifica pela saída do yt-dlp se a fonte baixada dispensa re-encode"""
+    if m := SELECTED_FORMAT_RE.search(output):
+        return YOUTUBE_AUDIO_ITAGS.get(m.group(1)) == TARGET_CODECS.get(config["format"])
+    return False
+
+# ---------- WATCHDOG DOS PROCESSOS YT-DLP ----------
+PROGRESS_PERCENT_RE = re.compile(r'^\[download\]\s+(\d+\.?\d*)%')
+PROGRESS_BYTES_RE = re.compile(r'bytes=(\d+)')
+# Mantém o formato "[download] NN.N%" que as barras de progresso leem e acrescenta
+# os bytes baixados: em arquivos grandes 0,1% pode levar mais que o stall_timeout
+PROGRESS_ARGS = ["--progress-template",
+                 "download:[download] %(progress._percent_str)s bytes=%(progress.downloaded_bytes)s"]
+
+def kill_process_tree(process: subprocess.Popen):
+    """Mata o yt-dlp e os filhos (ffmpeg) do mesmo grupo de processos"""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def run_tracked(cmd: List[str], timeout: Optional[float] = None,
+                capture: bool = False) -> subprocess.CompletedProcess:
+    """subprocess.run para comandos auxiliares (yt-dlp, ffmpeg) que rodam dentro de jobs.
+
+    O processo fica registrado no job atual, para Job.kill() encerrá-lo, e a saída
+    vai para o log do job em vez de aparecer por cima do menu. Com capture=True a
+    saída só é devolvida, como no capture_output do subprocess.run.
+    """
+    job = current_job()
+    if job and job.cancelled.is_set():
+        raise JobCancelled()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               start_new_session=hasattr(os, "killpg"))
+    if job:
+        job.processes.add(process)
+        if job.cancelled.is_set():
+            kill_process_tree(process)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(process)
+        process.communicate()
+        raise
+    finally:
+        if job:
+            job.processes.discard(process)
+    if job and job.cancelled.is_set():
+        raise JobCancelled()
+    if not capture:
+        for text, stream in ((stdout, sys.stdout), (stderr, sys.stderr)):
+            if not text:
+                continue
+            if job:
+                for line in text.splitlines():
+                    job.log(line)
+            else:
+                stream.write(text)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+YtdlpResult = namedtuple("YtdlpResult", "returncode output event cpu")
+
+def run_ytdlp(cmd: List[str], on_line, config: Dict[str, Any],
+              summary: Optional[RunSummary] = None, label: str = "") -> YtdlpResult:
+    """Executa o yt-dlp com watchdog de travamento e orçamento de tempo.
+
+    Retorna (returncode, saída sem linhas de progresso, evento, segundos de CPU)
+    onde evento é None, "stalled" ou "budget".
+    """
+    stall_timeout = float(config.get("stall_timeout", 0) or 0)
+    job_budget = float(config.get("job_budget", 0) or 0)
+    phase, phase_start = "spawn", TRACER.now()
+    job = current_job()
+    if job and job.cancelled.is_set():
+        raise JobCancelled()
+    process = subprocess.Popen(
+        cmd[:1] + PROGRESS_ARGS + cmd[1:],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        bufsize=1,
+        start_new_session=hasattr(os, "killpg")
+    )
+    if job:
+        # Registrado no job para ser morto se o programa sair com ele rodando
+        job.processes.add(process)
+        if job.cancelled.is_set():
+            kill_process_tree(process)
+    lines: queue.Queue = queue.Queue()
+
+    def reader():
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+    output = deque(maxlen=40)
+    started = last_advance = time.monotonic()
+    best_progress = -1.0
+    event = None
+    while True:
+        try:
+            line = lines.get(timeout=1)
+        except queue.Empty:
+            line = ""
+        if line is None:
+            break
+        now = time.monotonic()
+        if line:
+            on_line(line)
+            if TRACER.enabled:
+                stripped = line.lstrip()
+                current = next((name for prefix, name in YTDLP_PHASES if stripped.startswith(prefix)),
+                               "extract" if phase == "spawn" else phase)
+                if current != phase:
+                    stamp = TRACER.now()
+                    TRACER.add(phase, "ytdlp", phase_start, stamp, job=label)
+                    phase, phase_start = current, stamp
+            if m := PROGRESS_PERCENT_RE.match(line):
+                # Avanço = mais bytes baixados (ou %, se o yt-dlp não informar bytes)
+                b = PROGRESS_BYTES_RE.search(line)
+                current_progress = float(b.group(1)) if b else float(m.group(1))
+                if current_progress > best_progress:
+                    best_progress = current_progress
+                    last_advance = now
+            else:
+                output.append(line)
+                if line.startswith("["):
+                    # Nova etapa (extração, destino, pós-processamento) reinicia a contagem;
+                    # avisos e erros soltos não contam como progresso
+                    if line.startswith("[download] Destination"):
+                        best_progress = -1.0
+                    last_advance = now
+        if stall_timeout and now - last_advance > stall_timeout:
+            event = "stalled"
+        elif job_budget and now - started > job_budget:
+            event = "budget"
+        if event:
+            kill_process_tree(process)
+            message = (f"Watchdog: sem progresso por {stall_timeout:.0f}s" if event == "stalled"
+                       else f"Watchdog: orçamento de {job_budget:.0f}s esgotado")
+            message += f" ({label})" if label else ""
+            if summary:
+                summary.event(message)
+            TermuxLogger.warning(message)
+            break
+    if hasattr(os, "wait4"):
+        # O rusage do wait4 inclui os filhos já coletados pelo yt-dlp (ffmpeg)
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+        cpu = usage.ru_utime + usage.ru_stime
+    else:
+        process.wait()
+        cpu = 0.0
+    TRACER.add(phase, "ytdlp", phase_start, TRACER.now(), job=label, returncode=process.returncode)
+    if job:
+        job.processes.discard(process)
+        if job.cancelled.is_set():
+            raise JobCancelled()
+    return YtdlpResult(process.returncode, "".join(output), event, cpu)
+
+# ---------- TAGS (ESCRITA DIRETA, SEM REMUX) ----------
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".opus", ".ogg", ".flac")
+COVER_CACHE_SIZE = 64
+_cover_cache: Dict[str, Optional[bytes]] = {}
+_cover_lock = threading.Lock()
+
+def fetch_cover(url: Optional[str]) -> Optional[bytes]:
+    """Baixa a capa do álbum (cache em memória: faixas do mesmo álbum repetem a URL)"""
+    if not url:
+        return None
+    with _cover_lock:
+        if url in _cover_cache:
+            return _cover_cache[url]
+    try:
+        response = requests.get(url, timeout=15)
+        response.raise_for_status()
+        data = response.content
+    except Exception as e:
+        TermuxLogger.warning(f"Capa indisponível: {e}")
+        data = None
+    with _cover_lock:
+        if len(_cover_cache) >= COVER_CACHE_SIZE:
+            _cover_cache.pop(next(iter(_cover_cache)))
+        _cover_cache[url] = data
+    return data
+
+def _tag_id3(path: Path, metadata: Dict[str, Any], cover: Optional[bytes]):
+    try:
+        tags = ID3(str(path))
+    except ID3NoHeaderError:
+        tags = ID3()
+    tags.setall("TIT2", [TIT2(encoding=3, text=metadata["name"])])
+    tags.setall("TPE1", [TPE1(encoding=3, text=metadata["artist"])])
+    tags.setall("TALB", [TALB(encoding=3, text=metadata["album"])])
+    tags.setall("TDRC", [TDRC(encoding=3, text=metadata["date"])])
+    tags.setall("TRCK", [TRCK(encoding=3, text=f"{metadata['track_number']}/{metadata['track_count']}")])
+    if metadata.get("genre"):
+        tags.setall("TCON", [TCON(encoding=3, text=metadata["genre"].split(";"))])
+    if metadata.get("isrc"):
+        tags.setall("TSRC", [TSRC(encoding=3, text=metadata["isrc"])])
+    if cover:
+        tags.setall("APIC", [APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover)])
+    tags.save(str(path), v2_version=3)
+
+def _tag_mp4(path: Path, metadata: Dict[str, Any], cover: Optional[bytes]):
+    audio = MP4(str(path))
+    audio["\xa9nam"] = metadata["name"]
+    audio["\xa9ART"] = metadata["artist"]
+    audio["\xa9alb"] = metadata["album"]
+    audio["\xa9day"] = metadata["date"]
+    audio["trkn"] = [(int(metadata["track_number"]), int(metadata["track_count"]))]
+    if metadata.get("genre"):
+        audio["\xa9gen"] = metadata["genre"].split(";")
+    if cover:
+        audio["covr"] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    audio.save()
+
+def _vorbis_comments(metadata: Dict[str, Any]) -> Dict[str, List[str]]:
+    comments = {
+        "title": [metadata["name"]],
+        "artist": [metadata["artist"]],
+        "album": [metadata["album"]],
+        "date": [metadata["date"]],
+        "tracknumber": [str(metadata["track_number"])],
+        "tracktotal": [str(metadata["track_count"])],
+    }
+    if metadata.get("genre"):
+        comments["genre"] = metadata["genre"].split(";")
+    if metadata.get("isrc"):
+        comments["isrc"] = [metadata["isrc"]]
+    return comments
+
+def _cover_picture(cover: bytes) -> "Picture":
+    picture = Picture()
+    picture.type = 3
+    picture.mime = "image/jpeg"
+    picture.desc = "Cover"
+    picture.data = cover
+    return picture
+
+def _tag_ogg(path: Path, metadata: Dict[str, Any], cover: Optional[bytes]):
+    audio = OggOpus(str(path)) if path.suffix == ".opus" else OggVorbis(str(path))
+    audio.update(_vorbis_comments(metadata))
+    if cover:
+        encoded = base64.b64encode(_cover_picture(cover).write()).decode("ascii")
+        audio["metadata_block_picture"] = [encoded]
+    audio.save()
+
+def _tag_flac(path: Path, metadata: Dict[str, Any], cover: Optional[bytes]):
+    audio = FLAC(str(path))
+    audio.update(_vorbis_comments(metadata))
+    if cover:
+        audio.clear_pictures()
+        audio.add_picture(_cover_picture(cover))
+    audio.save()
+
+TAG_WRITERS = {
+    ".mp3": _tag_id3,
+    ".m4a": _tag_mp4,
+    ".mp4": _tag_mp4,
+    ".opus": _tag_ogg,
+    ".ogg": _tag_ogg,
+    ".flac": _tag_flac,
+}
+
+def write_tags(path: Path, metadata: Dict[str, Any], cover: Optional[bytes] = None) -> bool:
+    """Escreve as tags do Spotify direto no arquivo, sem reescrever o áudio"""
+    writer = TAG_WRITERS.get(path.suffix.lower())
+    if not HAS_MUTAGEN or not writer:
+        return False
+    try:
+        cover = cover if cover is not None else fetch_cover(metadata.get("cover_url"))
+        with TRACER.span("tag", "io", file=path.name):
+            writer(path, metadata, cover)
+        return True
+    except Exception as e:
+        TermuxLogger.warning(f"Erro ao gravar tags em {path.name}: {e}")
+        return False
+
+def find_track_file(folder: Path, metadata: Dict[str, Any], config: Dict[str, Any]) -> Optional[Path]:
+    """Localiza o arquivo final de uma track baixada com o nome padrão"""
+    safe_name = sanitize_filename(metadata["search"])
+    expected = folder / f"{safe_name}.{config['format']}"
+    if expected.exists():
+        return expected
+    for candidate in folder.glob(f"{glob.escape(safe_name)}.*"):
+        if candidate.suffix.lower() in AUDIO_EXTENSIONS:
+            return candidate
+    return None
+
+def retag_existing(tracks: List[Dict[str, Any]], folder: Path, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Reaplica tags em lote nas tracks já baixadas e retorna as que faltam baixar"""
+    if not HAS_MUTAGEN:
+        return tracks
+    existing = [(track, path) for track in tracks if (path := find_track_file(folder, track, config))]
+    if not existing:
+        return tracks
+    TermuxLogger.info(f"Atualizando tags de {len(existing)} arquivos existentes...")
+    with job_thread_pool(8) as pool:
+        list(pool.map(lambda item: write_tags(item[1], item[0]), existing))
+    done = {id(track) for track, _ in existing}
+    return [track for track in tracks if id(track) not in done]
+
+# ---------- STAGING EM ARMAZENAMENTO INTERNO ----------
+STAGING_DIR = Path.home() / ".cache" / "rimusic" / "staging"
+STAGING_COPY_BUFFER = 4 * 1024 * 1024
+
+class StagingArea:
+    """Baixa no armazenamento interno do app e move para o download_dir em lotes.
+
+    No Termux o download_dir costuma ficar em /sdcard (FUSE), onde .part, renomeações
+    e temporários do ffmpeg são lentos. Aqui só os arquivos prontos chegam lá.
+    """
+    def __init__(self, config: Dict[str, Any]):
+        self.enabled = bool(config.get("staging"))
+        self.root = Path(config.get("staging_dir") or STAGING_DIR)
+        self.final_root = Path(config["download_dir"])
+        self.batch_size = int(config.get("staging_batch", 25))
+        # Um ledger por instância: jobs simultâneos não recolhem arquivos uns dos outros
+        self.ledger = self.root / f".finished-{os.getpid()}-{id(self):x}.txt"
+        self.pending: List[Path] = []
+        self.lock = threading.Lock()
+        self.moved = 0
+        self.io_time = 0.0
+        if job := current_job():
+            # Job interrompido: o que já terminou ainda vai para o download_dir
+            job.cleanups.append(lambda: self.flush(force=True))
+
+    def folder_for(self, folder: Path) -> Path:
+        """Pasta de trabalho equivalente à pasta final"""
+        if not self.enabled:
+            return folder
+        try:
+            relative = folder.resolve().relative_to(self.final_root.resolve())
+        except ValueError:
+            relative = Path(folder.name)
+        return ensure_directory(self.root / relative)
+
+    def job_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Config para os comandos yt-dlp: registram o arquivo final no ledger"""
+        if not self.enabled:
+            return config
+        return {**config, "staging_ledger": str(self.ledger)}
+
+    def add(self, path: Optional[Path]):
+        if self.enabled and path:
+            with self.lock:
+                self.pending.append(path)
+
+    def _collect_ledger(self):
+        if not self.ledger.exists():
+            return
+        # Renomeia antes de ler: o yt-dlp reabre o arquivo a cada linha
+        processing = self.ledger.with_suffix(".processing")
+        os.replace(self.ledger, processing)
+        with open(processing, 'r', encoding='utf-8') as f:
+            paths = [Path(line.strip()) for line in f if line.strip()]
+        processing.unlink(missing_ok=True)
+        with self.lock:
+            self.pending.extend(paths)
+
+    def _move(self, src: Path, dest: Path):
+        ensure_directory(dest.parent)
+        if dest.exists():
+            # Mesmo comportamento do --no-overwrites
+            src.unlink(missing_ok=True)
+            return
+        try:
+            os.replace(src, dest)
+            return
+        except OSError:
+            pass
+        # Outro sistema de arquivos: cópia sequencial + rename atômico no destino
+        tmp = dest.with_name(f".{dest.name}.staging")
+        with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+            shutil.copyfileobj(fin, fout, STAGING_COPY_BUFFER)
+        os.replace(tmp, dest)
+        src.unlink(missing_ok=True)
+
+    def flush(self, force: bool = False):
+        """Move os arquivos prontos quando o lote enche (ou sempre, com force)"""
+        if not self.enabled:
+            return
+        self._collect_ledger()
+        with self.lock:
+            if not self.pending or (len(self.pending) < self.batch_size and not force):
+                return
+            batch = sorted(set(self.pending))
+            self.pending.clear()
+        started = time.monotonic()
+        trace_start = TRACER.now()
+        for src in batch:
+            if not src.exists():
+                continue
+            try:
+                dest = self.final_root / src.resolve().relative_to(self.root.resolve())
+                self._move(src, dest)
+                self.moved += 1
+            except Exception as e:
+                TermuxLogger.error(f"Erro ao mover {src.name}: {e}")
+        self.io_time += time.monotonic() - started
+        TRACER.add("move", "io", trace_start, TRACER.now(), files=len(batch))
+        TermuxLogger.info(f"Staging: {len(batch)} arquivos movidos para {self.final_root}")
+
+    def report(self):
+        if self.enabled and self.moved:
+            TermuxLogger.info(f"Staging: {self.moved} arquivos, {self.io_time / self.moved:.2f}s de I/O por arquivo")
+
+def record_staged(config: Dict[str, Any], path: Path):
+    """Anota no ledger um arquivo final produzido fora do yt-dlp"""
+    if config.get("staging_ledger"):
+        with open(config["staging_ledger"], 'a', encoding='utf-8') as f:
+            f.write(f"{path}\n")
+
+def staging_args(config: Dict[str, Any]) -> List[str]:
+    """Faz o yt-dlp anotar o caminho final de cada arquivo no ledger do staging"""
+    if config.get("staging_ledger"):
+        return ["--print-to-file", "after_move:filepath", config["staging_ledger"]]
+    return []
+
+# ---------- CACHE SPOTIFY -> YOUTUBE ----------
+MATCH_CACHE_FILE = SCRIPT_DIR / "match_cache.jsonl"
+
+def youtube_watch_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+class MatchCache:
+    """Mapa persistente track -> vídeo escolhido no YouTube (id e duração).
+
+    Gravado como log JSONL só de acréscimos (a última linha de cada chave vale),
+    compactado ao carregar quando há muitas linhas obsoletas.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @staticmethod
+    def key(metadata: Dict[str, Any]) -> str:
+        if metadata.get("id"):
+            return f"spotify:{metadata['id']}"
+        normalized = re.sub(r'[^\w\s]', '', metadata["search"].lower())
+        return "q:" + re.sub(r'\s+', ' ', normalized).strip()
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        lines = 0
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    lines += 1
+                    if record.get("video_id"):
+                        self.entries[record["key"]] = record
+                    else:
+                        self.entries.pop(record["key"], None)
+        if lines > 2 * len(self.entries) + 100:
+            self._compact()
+
+    def _compact(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def _append(self, record: Dict[str, Any]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def get(self, metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            self._load()
+            return self.entries.get(self.key(metadata))
+
+    def put(self, metadata: Dict[str, Any], video_id: str, duration: Optional[int]):
+        record = {"key": self.key(metadata), "video_id": video_id, "duration": duration}
+        with self.lock:
+            self._load()
+            if self.entries.get(record["key"]) != record:
+                self.entries[record["key"]] = record
+                self._append(record)
+
+    def drop(self, metadata: Dict[str, Any]):
+        with self.lock:
+            self._load()
+            if self.entries.pop(self.key(metadata), None):
+                self._append({"key": self.key(metadata), "video_id": None})
+
+MATCH_CACHE = MatchCache(MATCH_CACHE_FILE)
+
+def read_match_file(path: Path) -> Optional[tuple]:
+    """Lê o "id<TAB>duração" gravado pelo yt-dlp via --print-to-file"""
+    try:
+        line = path.read_text(encoding='utf-8').strip().splitlines()[-1]
+    except (OSError, IndexError):
+        return None
+    video_id, _, duration = line.partition("\t")
+    return video_id, int(float(duration)) if duration.replace(".", "", 1).isdigit() else None
+
 # ---------- DOWNLOADER ----------
-def download_with_metadata(metadata: Dict[str, Any], folder: Path, config: Dict[str, Any], 
+def download_with_metadata(metadata: Dict[str, Any], folder: Path, config: Dict[str, Any],
                           cookies: Optional[Path] = None) -> bool:
     """Faz download com metadados do Spotify"""
+    status = download_track(metadata, folder, config, cookies)
+    if status == Failure.RATE_LIMITED:
+        # Sem fila para reenfileirar: espera o limite passar e tenta uma vez mais
+        TermuxLogger.warning(f"Limite de taxa atingido, aguardando {RATE_LIMIT_COOLDOWN:.0f}s...")
+        TRACER.sleep(RATE_LIMIT_COOLDOWN, "rate limit")
+        status = download_track(metadata, folder, config, cookies)
+    return status == "ok"
+
+def download_track(metadata: Dict[str, Any], folder: Path, config: Dict[str, Any],
+                   cookies: Optional[Path] = None, summary: Optional[RunSummary] = None) -> str:
+    """Baixa uma track e retorna "ok" ou a classe da falha (Failure.*)"""
     TermuxLogger.info(f"Baixando: {metadata['search']}")
     safe_name = sanitize_filename(metadata["search"])
     output_template = str(folder / f"{safe_name}.%(ext)s")
+    fd, match_name = tempfile.mkstemp(prefix="rimusic-match-", suffix=".txt")
+    os.close(fd)
+    match_file = Path(match_name)
+    match_args = ["--print-to-file", "after_move:%(id)s\t%(duration)s", str(match_file)]
     cmd = [
         "yt-dlp",
-        "ytsearch1:" + metadata["search"],
         "--extract-audio",
         "--audio-format", config["format"],
         "--audio-quality", config["audio_quality"],
-        "--embed-metadata",
-        "--embed-thumbnail",
+    ] + audio_format_args(config) + match_args
+    if not HAS_MUTAGEN:
+        cmd.extend(["--embed-metadata", "--embed-thumbnail"])
+    cmd += [
         "--output", output_template,
         "--ignore-errors",
         "--no-overwrites",
@@ -312,36 +1319,69 @@ def download_with_metadata(metadata: Dict[str, Any], folder: Path, config: Dict[
     ]
     if metadata.get("genre"):
         metadata_args.extend(["--parse-metadata", f"genre:{metadata['genre']}"])
-    cmd.extend(metadata_args)
-    progress = SmoothProgress(metadata["search"])
-    progress.start()
+    if not HAS_MUTAGEN:
+        cmd.extend(metadata_args)
+
+    def attempt(source: str) -> str:
+        for retry in range(RETRY_ATTEMPTS + 1):
+            progress = SmoothProgress(metadata["search"])
+            progress.start()
+            try:
+                result = run_ytdlp(cmd + ["--", source], progress.update, config, summary, metadata["search"])
+                if result.event:
+                    status = Failure.STALLED
+                elif result.returncode == 0:
+                    status = "ok"
+                    if summary:
+                        summary.record_cpu(is_stream_copy(result.output, config), result.cpu)
+                else:
+                    status = classify_failure(result.output)
+            except Exception as e:
+                TermuxLogger.error(f"Erro no download: {e}")
+                status = Failure.UNKNOWN
+            finally:
+                progress.stop()
+            if status != Failure.NETWORK or retry == RETRY_ATTEMPTS:
+                return status
+            delay = backoff_delay(retry)
+            TermuxLogger.warning(f"Erro de rede, nova tentativa em {delay:.0f}s...")
+            TRACER.sleep(delay, "backoff")
+        return status
+
     try:
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
-        )
-        for line in process.stdout:
-            progress.update(line)
-        process.wait()
-        success = process.returncode == 0
-    except Exception as e:
-        TermuxLogger.error(f"Erro no download: {e}")
-        success = False
+        # Vídeo já escolhido antes: vai direto nele, sem nova busca
+        cached = MATCH_CACHE.get(metadata)
+        if cached:
+            status = attempt(youtube_watch_url(cached["video_id"]))
+            if status in (Failure.UNAVAILABLE, Failure.NOT_FOUND):
+                TermuxLogger.info("Vídeo do cache indisponível, buscando de novo...")
+                MATCH_CACHE.drop(metadata)
+                cached = None
+        if not cached:
+            status = attempt("ytsearch1:" + metadata["search"])
+        if status == "ok":
+            TermuxLogger.success(f"Concluído: {metadata['search']}")
+        elif status in (Failure.NOT_FOUND, Failure.UNKNOWN):
+            # Só faz sentido buscar termos alternativos quando o vídeo certo não foi achado
+            TermuxLogger.warning(f"Tentando fallback para: {metadata['search']}")
+            if download_fallback(metadata, folder, config, cookies, match_args):
+                status = "ok"
+        if status == "ok":
+            if not cached and (match := read_match_file(match_file)):
+                MATCH_CACHE.put(metadata, *match)
+            if HAS_MUTAGEN and (path := find_track_file(folder, metadata, config)):
+                write_tags(path, metadata)
+            TRACER.sleep(config["tick"], "tick")
+        elif status == Failure.UNAVAILABLE:
+            TermuxLogger.error(f"Indisponível (bloqueado/privado), pulando: {metadata['search']}")
+        elif status == Failure.NETWORK:
+            TermuxLogger.error(f"Falha de rede persistente: {metadata['search']}")
+        return status
     finally:
-        progress.stop()
-    if success:
-        TermuxLogger.success(f"Concluído: {metadata['search']}")
-    else:
-        TermuxLogger.warning(f"Tentando fallback para: {metadata['search']}")
-        success = download_fallback(metadata, folder, config, cookies)
-    time.sleep(config["tick"])
-    return success
+        match_file.unlink(missing_ok=True)
 
-def download_fallback(metadata: Dict[str, Any], folder: Path, config: Dict[str, Any], 
-                     cookies: Optional[Path]) -> bool:
+def download_fallback(metadata: Dict[str, Any], folder: Path, config: Dict[str, Any],
+                     cookies: Optional[Path], extra_args: Optional[List[str]] = None) -> bool:
     """Tenta download alternativo"""
     fallback_terms = [
         metadata["search"] + " official audio",
@@ -356,14 +1396,14 @@ def download_fallback(metadata: Dict[str, Any], folder: Path, config: Dict[str,
                 "--extract-audio",
                 "--audio-format", config["format"],
                 "--audio-quality", config["audio_quality"],
-                "--embed-metadata",
-                "--embed-thumbnail",
                 "--output", str(folder / f"{sanitize_filename(metadata['search'])}.%(ext)s"),
                 "--ignore-errors"
-            ]
+            ] + audio_format_args(config) + (extra_args or [])
+            if not HAS_MUTAGEN:
+                cmd.extend(["--embed-metadata", "--embed-thumbnail"])
             if cookies and cookies.exists():
                 cmd.extend(["--cookies", str(cookies)])
-            result = subprocess.run(cmd, capture_output=True, timeout=120, text=True)
+            result = run_tracked(cmd, timeout=120, capture=True)
             if result.returncode == 0:
                 TermuxLogger.success(f"Fallback bem-sucedido: {term}")
                 return True
@@ -372,11 +1412,159 @@ def download_fallback(metadata: Dict[str, Any], folder: Path, config: Dict[str,
     TermuxLogger.error(f"Falha definitiva: {metadata['search']}")
     return False
 
+def media_args(config: Dict[str, Any]) -> List[str]:
+    """Argumentos do yt-dlp conforme o tipo de mídia configurado"""
+    if config["media_type"] == "audio":
+        return [
+            "--extract-audio",
+            "--audio-format", config["format"],
+            "--audio-quality", config["audio_quality"],
+            "--embed-metadata",
+            "--embed-thumbnail"
+        ] + audio_format_args(config)
+    return ["--format", config["video_quality"]]
+
+class PlaylistProgress(SmoothProgress):
+    """Progresso agregado de vários downloads paralelos da mesma playlist"""
+    def __init__(self, title: str, total: int):
+        super().__init__(title)
+        self.name = title[:30]
+        self.total = max(1, total)
+        self.entries: Dict[int, float] = {}
+        self.finished = 0
+        self.lock = threading.Lock()
+        self._refresh()
+
+    def update_entry(self, index: int, line: str):
+        if "[download]" in line:
+            if m := re.search(r'(\d+\.?\d*)%', line):
+                with self.lock:
+                    self.entries[index] = float(m.group(1))
+                    self._refresh()
+
+    def finish_entry(self, index: int):
+        with self.lock:
+            self.entries[index] = 100.0
+            self.finished += 1
+            self._refresh()
+
+    def _refresh(self):
+        self.percent = sum(self.entries.values()) / self.total
+        self.title = f"{self.finished}/{self.total} {self.name}"
+
+def enumerate_youtube_playlist(url: str, cookies: Optional[Path]) -> Optional[tuple]:
+    """Lista rapidamente as entradas da playlist (--flat-playlist), sem baixar nada"""
+    cmd = ["yt-dlp", url, "--yes-playlist", "--flat-playlist", "--dump-single-json", "--no-warnings"]
+    if cookies and cookies.exists():
+        cmd.extend(["--cookies", str(cookies)])
+    try:
+        result = run_tracked(cmd, timeout=120, capture=True)
+        if result.returncode != 0:
+            return None
+        data = json.loads(result.stdout)
+    except Exception as e:
+        TermuxLogger.warning(f"Não foi possível listar a playlist: {e}")
+        return None
+    entries = [
+        entry.get("url") or f"https://www.youtube.com/watch?v={entry['id']}"
+        for entry in data.get("entries") or []
+        if entry and (entry.get("url") or entry.get("id"))
+    ]
+    return data.get("title") or "Playlist", entries
+
+def playlist_output(folder: Path, title: str) -> tuple:
+    """(pasta, template de saída <pasta>/%(title)s.%(ext)s) da playlist.
+
+    O nome da pasta sai sempre do sanitize_filename, no modo em shards e no serial;
+    o %(playlist_title)s do yt-dlp sanitiza diferente (mantém "：", não corta em 100).
+    """
+    output_dir = folder / (sanitize_filename(title) or "Playlist")
+    return output_dir, str(output_dir).replace("%", "%%") + os.sep + "%(title)s.%(ext)s"
+
+def probe_playlist_title(url: str, cookies: Optional[Path]) -> Optional[str]:
+    """Título da playlist consultando só a primeira entrada"""
+    cmd = ["yt-dlp", url, "--yes-playlist", "--flat-playlist", "--playlist-items", "1",
+           "--print", "playlist_title", "--no-warnings"]
+    if cookies and cookies.exists():
+        cmd.extend(["--cookies", str(cookies)])
+    try:
+        result = run_tracked(cmd, timeout=60, capture=True)
+    except subprocess.TimeoutExpired:
+        return None
+    title = result.stdout.strip().splitlines()[0] if result.returncode == 0 and result.stdout.strip() else ""
+    return title if title and title != "NA" else None
+
 def download_youtube_playlist(url: str, folder: Path, config: Dict[str, Any], cookies: Optional[Path]) -> bool:
-    """Baixa playlist completa do YouTube ou YouTube Music"""
+    """Baixa playlist completa do YouTube ou YouTube Music, dividida entre vários workers"""
+    TermuxLogger.info("Listando playlist do YouTube...")
+    listing = enumerate_youtube_playlist(url, cookies)
+    if not listing or not listing[1]:
+        return download_youtube_playlist_serial(url, folder, config, cookies,
+                                                listing[0] if listing else None)
+    title, entries = listing
+    workers = max(1, min(int(config.get("playlist_workers", 3)), len(entries)))
+    TermuxLogger.info(f"{title}: {len(entries)} vídeos em {workers} workers...")
+    # Mesma pasta do modo serial: os dois usam playlist_output
+    output_dir, output_template = playlist_output(folder, title)
+    progress = PlaylistProgress(title, len(entries))
+    summary = RunSummary()
+
+    def download_entry(index: int, entry_url: str) -> bool:
+        if config["media_type"] == "video" and config.get("video_backend") == "segmented":
+            result = segmented_download(entry_url, output_dir, config, cookies)
+            if result is not None:
+                progress.finish_entry(index)
+                return result
+        cmd = [
+            "yt-dlp",
+            entry_url,
+            "--no-playlist",
+            "--output", output_template,
+            "--ignore-errors",
+            "--no-overwrites",
+            "--newline"
+        ] + media_args(config) + staging_args(config)
+        if cookies and cookies.exists():
+            cmd.extend(["--cookies", str(cookies)])
+        try:
+            for _ in range(REQUEUE_LIMIT + 1):
+                returncode, _, event, _ = run_ytdlp(cmd, lambda line: progress.update_entry(index, line),
+                                                 config, summary, entry_url)
+                if not event:
+                    break
+            return returncode == 0 and not event
+        except Exception as e:
+            TermuxLogger.error(f"Erro no vídeo {entry_url}: {e}")
+            return False
+        finally:
+            progress.finish_entry(index)
+
+    progress.start()
+    try:
+        with job_thread_pool(workers) as pool:
+            results = list(pool.map(download_entry, range(len(entries)), entries))
+    finally:
+        progress.stop()
+    for message in summary.events:
+        TermuxLogger.info(message)
+    success_count = sum(results)
+    if success_count == len(entries):
+        TermuxLogger.success(f"Playlist baixada com sucesso! ({success_count} vídeos)")
+        return True
+    TermuxLogger.error(f"Playlist incompleta: {success_count}/{len(entries)} vídeos")
+    return False
+
+def download_youtube_playlist_serial(url: str, folder: Path, config: Dict[str, Any], cookies: Optional[Path],
+                                    title: Optional[str] = None) -> bool:
+    """Baixa playlist completa num único processo do yt-dlp (fallback)"""
     try:
         TermuxLogger.info("Baixando playlist do YouTube...")
-        output_template = str(folder / "%(playlist_title)s" / "%(title)s.%(ext)s")
+        title = title or probe_playlist_title(url, cookies)
+        if title:
+            _, output_template = playlist_output(folder, title)
+        else:
+            # Título desconhecido: só aqui o yt-dlp nomeia a pasta
+            output_template = str(folder / "%(playlist_title)s" / "%(title)s.%(ext)s")
         cmd = [
             "yt-dlp",
             url,
@@ -386,33 +1574,20 @@ def download_youtube_playlist(url: str, folder: Path, config: Dict[str, Any], co
             "--no-overwrites",
             "--newline"
         ]
-        if config["media_type"] == "audio":
-            cmd.extend([
-                "--extract-audio",
-                "--audio-format", config["format"],
-                "--audio-quality", config["audio_quality"],
-                "--embed-metadata",
-                "--embed-thumbnail"
-            ])
-        else:
-            cmd.extend(["--format", config["video_quality"]])
+        cmd.extend(media_args(config))
+        cmd.extend(staging_args(config))
         if cookies and cookies.exists():
             cmd.extend(["--cookies", str(cookies)])
 
         progress = SmoothProgress("Playlist do YouTube")
         progress.start()
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
-        )
-        for line in process.stdout:
-            progress.update(line)
-        process.wait()
+        # Um único processo para a playlist inteira: só o watchdog de travamento se aplica
+        for _ in range(REQUEUE_LIMIT + 1):
+            returncode, _, event, _ = run_ytdlp(cmd, progress.update, {**config, "job_budget": 0}, label=url)
+            if not event:
+                break
         progress.stop()
-        if process.returncode == 0:
+        if returncode == 0 and not event:
             TermuxLogger.success("Playlist baixada com sucesso!")
             return True
         else:
@@ -435,6 +1610,12 @@ def download_from_url(url: str, folder: Path, config: Dict[str, Any], cookies: O
                     TermuxLogger.info("Playlist do YouTube detectada. Baixando todos os vídeos...")
                     return download_youtube_playlist(url, folder, config, cookies)
 
+        if config["media_type"] == "video" and config.get("video_backend") == "segmented":
+            result = segmented_download(url, folder, config, cookies)
+            if result is not None:
+                return result
+            TermuxLogger.info("Formato sem suporte a ranges, usando yt-dlp...")
+
         # Caso não seja playlist, baixa único com nome correto
         TermuxLogger.info("Obtendo título do vídeo...")
         cmd_title = [
@@ -443,7 +1624,7 @@ def download_from_url(url: str, folder: Path, config: Dict[str, Any], cookies: O
             "--no-warnings",
             url
         ]
-        result = subprocess.run(cmd_title, capture_output=True, text=True, timeout=15)
+        result = run_tracked(cmd_title, timeout=15, capture=True)
         title = result.stdout.strip() if result.returncode == 0 else None
         if not title:
             title = url.split("/")[-1] or "download"
@@ -459,37 +1640,939 @@ def download_from_url(url: str, folder: Path, config: Dict[str, Any], cookies: O
             "--no-overwrites",
             "--newline"
         ]
-        if config["media_type"] == "audio":
-            cmd.extend([
-                "--extract-audio",
-                "--audio-format", config["format"],
-                "--audio-quality", config["audio_quality"],
-                "--embed-metadata",
-                "--embed-thumbnail"
-            ])
-        else:
-            cmd.extend(["--format", config["video_quality"]])
+        cmd.extend(media_args(config))
+        cmd.extend(staging_args(config))
         if cookies and cookies.exists():
             cmd.extend(["--cookies", str(cookies)])
 
         progress = SmoothProgress(title)
         progress.start()
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
-        )
-        for line in process.stdout:
-            progress.update(line)
-        process.wait()
+        for _ in range(REQUEUE_LIMIT + 1):
+            returncode, _, event, _ = run_ytdlp(cmd, progress.update, config, label=title)
+            if not event:
+                break
         progress.stop()
-        return process.returncode == 0
+        return returncode == 0 and not event
     except Exception as e:
         TermuxLogger.error(f"Erro no download de URL: {e}")
         return False
 
+# ---------- DOWNLOAD SEGMENTADO (VÍDEO) ----------
+SEGMENT_REQUEST_SIZE = 10 * 1024 * 1024  # o googlevideo limita a taxa de ranges muito longos
+SEGMENT_STATE_INTERVAL = 1.0
+SEGMENT_CONNECT_TIMEOUT = 15
+SEGMENT_READ_TIMEOUT = 30  # sem stall_timeout configurado
+
+def load_cookie_jar(cookies: Optional[Path]):
+    """Carrega cookies.txt (formato Netscape) para uso com requests"""
+    if not cookies or not cookies.exists() or cookies.stat().st_size == 0:
+        return None
+    jar = http.cookiejar.MozillaCookieJar(str(cookies))
+    try:
+        jar.load(ignore_discard=True, ignore_expires=True)
+        return jar
+    except Exception:
+        return None
+
+class SegmentedDownloader:
+    """Baixa um arquivo HTTP com várias conexões de range, retomável via arquivo .segments.json"""
+    def __init__(self, url: str, dest: Path, headers: Optional[Dict[str, str]] = None,
+                 connections: int = 4, cookies=None, on_progress=None,
+                 stall_timeout: float = 0, deadline: Optional[float] = None):
+        self.url = url
+        self.dest = dest
+        self.part = dest.with_name(dest.name + ".part")
+        self.state_file = dest.with_name(dest.name + ".segments.json")
+        self.headers = dict(headers or {})
+        self.connections = max(1, connections)
+        self.cookies = cookies
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.segments: List[List[int]] = []
+        self.size = 0
+        self.last_save = 0.0
+        # Mesmo watchdog do yt-dlp: read timeout = tempo máximo sem receber bytes
+        self.stall_timeout = stall_timeout
+        self.timeout = (SEGMENT_CONNECT_TIMEOUT, stall_timeout or SEGMENT_READ_TIMEOUT)
+        self.deadline = deadline
+
+    def _check(self, job):
+        if job and job.cancelled.is_set():
+            # O progresso fica no .segments.json: dá para retomar depois
+            raise JobCancelled()
+        if self.deadline and time.monotonic() > self.deadline:
+            raise TimeoutError("Watchdog: orçamento de tempo esgotado")
+
+    def _probe_size(self) -> tuple:
+        response = requests.get(self.url, headers={**self.headers, "Range": "bytes=0-0"},
+                                cookies=self.cookies, stream=True, timeout=self.timeout)
+        response.close()
+        if response.status_code == 206:
+            if m := re.search(r'/(\d+)$', response.headers.get("Content-Range", "")):
+                return int(m.group(1)), True
+        response.raise_for_status()
+        return int(response.headers.get("Content-Length", 0)), False
+
+    def _load_state(self) -> bool:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state["size"] == self.size and self.part.exists():
+                self.segments = state["segments"]
+                return True
+        except (OSError, ValueError, KeyError):
+            pass
+        return False
+
+    def _save_state(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_save < SEGMENT_STATE_INTERVAL:
+            return
+        self.last_save = now
+        tmp = self.state_file.with_name(self.state_file.name + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"size": self.size, "segments": self.segments}, f)
+        os.replace(tmp, self.state_file)
+
+    def downloaded(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+    def _fetch_segment(self, segment: List[int]):
+        start, end, _ = segment
+        job = current_job()
+        with open(self.part, 'r+b') as f:
+            while start + segment[2] <= end:
+                self._check(job)
+                offset = start + segment[2]
+                stop = min(end, offset + SEGMENT_REQUEST_SIZE - 1)
+                headers = {**self.headers, "Range": f"bytes={offset}-{stop}"}
+                try:
+                    response = requests.get(self.url, headers=headers, cookies=self.cookies,
+                                            stream=True, timeout=self.timeout)
+                    with response:
+                        if response.status_code != 206:
+                            raise IOError(f"Servidor ignorou o range (HTTP {response.status_code})")
+                        f.seek(offset)
+                        for chunk in response.iter_content(STREAM_CHUNK):
+                            self._check(job)
+                            f.write(chunk)
+                            with self.lock:
+                                segment[2] += len(chunk)
+                                self._save_state()
+                            if self.on_progress:
+                                self.on_progress(self.downloaded(), self.size)
+                except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError) as e:
+                    # Leitura parada além do stall_timeout (o urllib3 às vezes a embrulha em ConnectionError)
+                    if "timed out" not in str(e).lower():
+                        raise
+                    raise TimeoutError(f"Watchdog: sem progresso por {self.timeout[1]:.0f}s") from e
+
+    def run(self) -> bool:
+        self.size, ranged = self._probe_size()
+        if not ranged or self.size <= 0:
+            return False
+        if not self._load_state():
+            step = -(-self.size // self.connections)
+            self.segments = [[start, min(start + step, self.size) - 1, 0]
+                             for start in range(0, self.size, step)]
+            with open(self.part, 'wb') as f:
+                f.truncate(self.size)
+        else:
+            TermuxLogger.info(f"Retomando {self.dest.name} ({self.downloaded() * 100 // self.size}%)")
+        pending = [segment for segment in self.segments if segment[0] + segment[2] <= segment[1]]
+        try:
+            with job_thread_pool(self.connections) as pool:
+                for future in [pool.submit(self._fetch_segment, segment) for segment in pending]:
+                    future.result()
+        finally:
+            with self.lock:
+                self._save_state(force=True)
+        if self.downloaded() != self.size:
+            return False
+        os.replace(self.part, self.dest)
+        self.state_file.unlink(missing_ok=True)
+        return True
+
+def resolve_direct_formats(url: str, config: Dict[str, Any], cookies: Optional[Path]) -> Optional[Dict[str, Any]]:
+    """Obtém as URLs diretas (HTTP progressivo) que o yt-dlp escolheria para o vídeo"""
+    cmd = ["yt-dlp", url, "--dump-json", "--no-playlist", "--no-warnings",
+           "--format", config["video_quality"]]
+    if cookies and cookies.exists():
+        cmd.extend(["--cookies", str(cookies)])
+    result = run_tracked(cmd, timeout=60, capture=True)
+    if result.returncode != 0:
+        return None
+    info = json.loads(result.stdout.splitlines()[0])
+    formats = info.get("requested_formats") or [info]
+    if not all(fmt.get("url") and fmt.get("protocol", "https") in ("http", "https") for fmt in formats):
+        return None
+    return {"title": info.get("title") or info.get("id") or "video", "ext": info.get("ext") or "mp4",
+            "formats": formats}
+
+def segmented_download(url: str, folder: Path, config: Dict[str, Any], cookies: Optional[Path] = None,
+                       title: Optional[str] = None) -> Optional[bool]:
+    """Backend segmentado do modo vídeo; None quando o formato não permite (usa o yt-dlp)"""
+    try:
+        info = resolve_direct_formats(url, config, cookies)
+    except Exception as e:
+        TermuxLogger.warning(f"Backend segmentado indisponível: {e}")
+        return None
+    if not info:
+        return None
+    safe_title = sanitize_filename(title or info["title"])
+    final_path = ensure_directory(folder) / f"{safe_title}.{info['ext']}"
+    if final_path.exists():
+        TermuxLogger.info(f"Já existe: {final_path.name}")
+        return True
+    jar = load_cookie_jar(cookies)
+    stall_timeout = float(config.get("stall_timeout", 0) or 0)
+    job_budget = float(config.get("job_budget", 0) or 0)
+    deadline = time.monotonic() + job_budget if job_budget else None
+    progress = SmoothProgress(safe_title)
+    totals: Dict[int, tuple] = {}
+
+    def report(index: int):
+        def callback(done: int, size: int):
+            totals[index] = (done, size)
+            progress.percent = 100.0 * sum(d for d, _ in totals.values()) / max(1, sum(s for _, s in totals.values()))
+        return callback
+
+    parts = []
+    progress.start()
+    try:
+        for index, fmt in enumerate(info["formats"]):
+            suffix = f".f{fmt.get('format_id', index)}.{fmt.get('ext', 'bin')}" if len(info["formats"]) > 1 else f".{info['ext']}"
+            dest = folder / f"{safe_title}{suffix}"
+            downloader = SegmentedDownloader(fmt["url"], dest, fmt.get("http_headers"),
+                                             int(config.get("segments", 4)), jar, report(index),
+                                             stall_timeout, deadline)
+            if not downloader.run():
+                return None if index == 0 and not downloader.segments else False
+            parts.append(dest)
+    except Exception as e:
+        TermuxLogger.error(f"Erro no download segmentado: {e}")
+        return False
+    finally:
+        progress.stop()
+    if len(parts) > 1:
+        merge = ["ffmpeg", "-y", "-loglevel", "error"]
+        for part in parts:
+            merge.extend(["-i", str(part)])
+        merge.extend(["-map", "0", "-map", "1", "-c", "copy", str(final_path)])
+        if run_tracked(merge).returncode != 0:
+            TermuxLogger.error("Falha ao juntar áudio e vídeo")
+            return False
+        for part in parts:
+            part.unlink(missing_ok=True)
+    record_staged(config, final_path)
+    TermuxLogger.success(f"Concluído: {final_path.name}")
+    return True
+
+def benchmark_video_backends(url: str, config: Dict[str, Any], cookies: Optional[Path] = None):
+    """Compara o yt-dlp padrão com o backend segmentado na mesma URL"""
+    results = []
+    for backend in ("ytdlp", "segmented"):
+        with tempfile.TemporaryDirectory(dir=config["download_dir"]) as tmp:
+            started = time.monotonic()
+            if backend == "segmented":
+                ok = segmented_download(url, Path(tmp), {**config, "media_type": "video"}, cookies, title="bench")
+            else:
+                cmd = ["yt-dlp", url, "--no-playlist", "--quiet", "--format", config["video_quality"],
+                       "--output", str(Path(tmp) / "bench.%(ext)s")]
+                if cookies and cookies.exists():
+                    cmd.extend(["--cookies", str(cookies)])
+                ok = subprocess.run(cmd).returncode == 0
+            elapsed = time.monotonic() - started
+            size = sum(f.stat().st_size for f in Path(tmp).iterdir() if f.is_file())
+            results.append((backend, bool(ok), elapsed, size))
+    print(f"\n{Color.BOLD}{'Backend':<12}{'Tempo':>9}{'MB':>9}{'MB/s':>8}{Color.RESET}")
+    for backend, ok, elapsed, size in results:
+        rate = size / elapsed / 1e6 if ok and elapsed else 0
+        status = "" if ok else "  (falhou)"
+        print(f"{backend:<12}{elapsed:>8.1f}s{size / 1e6:>9.1f}{rate:>8.2f}{status}")
+
+# ---------- TOCAR DURANTE O DOWNLOAD ----------
+STREAM_CHUNK = 64 * 1024
+HTTP_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+PLAYER_POLL_INTERVAL = 3
+PLAYER_PREPARE_GRACE = 30  # segundos para o termux-media-player começar a tocar
+STREAM_LINGER_MAX = 3 * 3600  # sem duração conhecida, o endpoint fica no máximo isso
+
+# Assinaturas de container para nomear o arquivo sem consultar o yt-dlp antes
+CONTAINER_SIGNATURES = [
+    (b'\x1a\x45\xdf\xa3', "webm"),
+    (b'OggS', "ogg"),
+    (b'ID3', "mp3"),
+    (b'fLaC', "flac"),
+]
+
+def sniff_extension(head: bytes, default: str = "bin") -> str:
+    """Descobre a extensão pelo início do stream"""
+    if head[4:8] == b'ftyp':
+        return "m4a" if head[8:11] in (b'M4A', b'dash') else "mp4"
+    for signature, ext in CONTAINER_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "mp3"
+    return default
+
+def detect_player(config: Dict[str, Any]) -> Optional[tuple]:
+    """Escolhe o player local: (comando, modo) onde modo é 'pipe' ou 'http'"""
+    audio_only = config["media_type"] == "audio"
+    candidates = {
+        "mpv": (["mpv", "--really-quiet", "--cache=yes"] + (["--no-video"] if audio_only else []) + ["-"], "pipe"),
+        "ffplay": (["ffplay", "-autoexit", "-loglevel", "quiet"] + (["-nodisp"] if audio_only else []) + ["-"], "pipe"),
+        "termux-media-player": (["termux-media-player", "play"], "http"),
+    }
+    preferred = config.get("player", "auto")
+    order = [preferred] if preferred in candidates else list(candidates)
+    for name in order:
+        if shutil.which(name):
+            return candidates[name]
+    return None
+
+def termux_player_active() -> Optional[bool]:
+    """termux-media-player está tocando (ou pausado)? None se não deu para consultar"""
+    try:
+        info = subprocess.run(["termux-media-player", "info"], capture_output=True,
+                              text=True, timeout=10).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return bool(re.search(r'Status:\s*(Playing|Paused)', info, re.I))
+
+class GrowingFileServer:
+    """Servidor HTTP local que entrega um arquivo enquanto ele ainda é escrito.
+
+    Durante o download responde 200 seguindo o arquivo; depois de complete()
+    passa a atender Range (206), para o player conseguir reconectar e buscar.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.size: Optional[int] = None
+        self.finished = threading.Event()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self.do_GET(body=False)
+
+            def do_GET(self, body: bool = True):
+                try:
+                    if server.size is None:
+                        self._stream_growing(body)
+                    else:
+                        self._send_range(server.size, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _stream_growing(self, body: bool):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.end_headers()
+                if not body:
+                    return
+                with open(server.path, 'rb') as f:
+                    while True:
+                        chunk = f.read(STREAM_CHUNK)
+                        if chunk:
+                            self.wfile.write(chunk)
+                        elif server.finished.is_set():
+                            break
+                        else:
+                            time.sleep(0.1)
+
+            def _send_range(self, size: int, body: bool):
+                start, end = 0, size - 1
+                m = HTTP_RANGE_RE.match(self.headers.get("Range", ""))
+                if m and (m.group(1) or m.group(2)):
+                    if m.group(1):
+                        start = int(m.group(1))
+                        end = min(int(m.group(2)), end) if m.group(2) else end
+                    else:
+                        start = max(0, size - int(m.group(2)))
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                if not body:
+                    return
+                with open(server.path, 'rb') as f:
+                    f.seek(start)
+                    remaining = end - start + 1
+                    while remaining > 0:
+                        chunk = f.read(min(STREAM_CHUNK, remaining))
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/stream"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def complete(self, path: Path):
+        """Download terminou (arquivo já renomeado): tamanho fixo, Range liberado"""
+        self.path = path
+        self.size = path.stat().st_size
+        self.finished.set()
+
+    def linger(self, limit: float):
+        """Mantém o endpoint até o termux-media-player parar (ou até limit segundos)"""
+        started = time.monotonic()
+        seen = False
+        while time.monotonic() - started < limit:
+            active = termux_player_active()
+            if active:
+                seen = True
+            elif active is False and (seen or time.monotonic() - started > PLAYER_PREPARE_GRACE):
+                # O MediaPlayer prepara de forma assíncrona: só desiste depois da carência
+                break
+            time.sleep(PLAYER_POLL_INTERVAL)
+        self.stop()
+
+    def stop(self):
+        self.finished.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def feed_player(player_proc: subprocess.Popen, path: Path, finished: threading.Event):
+    """Segue o arquivo que está sendo baixado e repassa ao stdin do player.
+
+    Roda em thread própria: o player lê em tempo real, mas o download para o
+    disco continua na velocidade da rede.
+    """
+    try:
+        with open(path, 'rb') as src:
+            while True:
+                chunk = src.read(STREAM_CHUNK)
+                if chunk:
+                    player_proc.stdin.write(chunk)
+                elif finished.is_set():
+                    break
+                else:
+                    time.sleep(0.05)
+    except (BrokenPipeError, OSError, ValueError):
+        # Player fechado pelo usuário: o download segue sozinho
+        pass
+    finally:
+        try:
+            player_proc.stdin.close()
+        except OSError:
+            pass
+
+def stream_download(source: str, folder: Path, config: Dict[str, Any],
+                    cookies: Optional[Path] = None, name: Optional[str] = None) -> Optional[Path]:
+    """Baixa e toca ao mesmo tempo: o stream do yt-dlp vai para o disco e para o player"""
+    player = detect_player(config)
+    if not player:
+        TermuxLogger.warning("Nenhum player encontrado (mpv/ffplay/termux-media-player)")
+        return None
+    player_cmd, mode = player
+    fmt = "bestaudio/best" if config["media_type"] == "audio" else "best"
+    cmd = [
+        "yt-dlp", source,
+        "--format", fmt,
+        "--output", "-",
+        "--quiet",
+        "--no-warnings",
+        "--no-part",
+        "--socket-timeout", "15",
+        "--retries", "5",
+    ]
+    if cookies and cookies.exists():
+        cmd.extend(["--cookies", str(cookies)])
+    # O título é obtido em paralelo para não atrasar o primeiro som
+    title_proc = None
+    if name is None:
+        title_proc = subprocess.Popen(["yt-dlp", "--print", "title", "--print", "duration",
+                                       "--no-warnings", source],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        name = source.split("/")[-1] or "download"
+    part_path = folder / f"{sanitize_filename(name) or 'stream'}.{os.getpid()}.stream.part"
+    server = None
+    player_proc = None
+    process = None
+    saved: Optional[Path] = None
+    linger = STREAM_LINGER_MAX
+    finished = threading.Event()
+    started = time.monotonic()
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        head = b''
+        with open(part_path, 'wb') as out:
+            while True:
+                chunk = process.stdout.read1(STREAM_CHUNK)
+                if not chunk:
+                    break
+                out.write(chunk)
+                out.flush()
+                if player_proc is None:
+                    head = chunk
+                    if mode == "pipe":
+                        player_proc = subprocess.Popen(player_cmd, stdin=subprocess.PIPE,
+                                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                        threading.Thread(target=feed_player, args=(player_proc, part_path, finished),
+                                         daemon=True).start()
+                    else:
+                        server = GrowingFileServer(part_path)
+                        server.start()
+                        player_proc = subprocess.Popen(player_cmd + [server.url],
+                                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                        TermuxLogger.info(f"Stream local: {server.url}")
+                    TermuxLogger.success(f"Tocando após {time.monotonic() - started:.1f}s: {name}")
+        process.wait()
+        finished.set()
+        if process.returncode != 0 or not head:
+            part_path.unlink(missing_ok=True)
+            TermuxLogger.error(f"Falha no stream: {name}")
+            return None
+        if title_proc:
+            try:
+                title = title_proc.communicate(timeout=15)[0].strip()
+            except subprocess.TimeoutExpired:
+                title_proc.kill()
+                title = ""
+            lines = title.splitlines()
+            name = lines[0] if lines else name
+            if len(lines) > 1 and re.fullmatch(r'\d+(\.\d+)?', lines[1]):
+                linger = float(lines[1]) * 1.5 + PLAYER_PREPARE_GRACE
+        final_path = folder / f"{sanitize_filename(name) or 'stream'}.{sniff_extension(head)}"
+        os.replace(part_path, final_path)
+        saved = final_path
+        TermuxLogger.success(f"Salvo: {final_path.name}")
+        return final_path
+    except Exception as e:
+        TermuxLogger.error(f"Erro no stream: {e}")
+        part_path.unlink(missing_ok=True)
+        return None
+    finally:
+        finished.set()
+        # Em caso de erro nada pode ficar rodando: yt-dlp e busca do título são encerrados
+        for proc in (process, title_proc):
+            if proc and proc.poll() is None:
+                proc.kill()
+            if proc:
+                proc.wait()
+        if player_proc:
+            if saved is None and player_proc.poll() is None:
+                player_proc.kill()
+            # O player segue tocando depois do download; a thread só o coleta ao sair
+            threading.Thread(target=player_proc.wait, daemon=True).start()
+        if server:
+            if saved is None:
+                server.stop()
+            else:
+                # O endpoint vive até o fim da reprodução, não só do download
+                server.complete(saved)
+                threading.Thread(target=server.linger, args=(linger,), daemon=True).start()
+
+# ---------- MANIFESTO PARA VÁRIOS DISPOSITIVOS ----------
+MANIFEST_LOCK_TTL = 10 * 60  # lock sem heartbeat por esse tempo é considerado abandonado
+MANIFEST_HEARTBEAT = 60  # intervalo em que o dono do lock renova o mtime
+MANIFEST_RECLAIM_TTL = 60  # trava de recuperação esquecida por um worker que morreu
+
+def write_manifest(tracks: List[Dict[str, Any]], folder_name: str, manifest_path: Path) -> Path:
+    """Grava a tracklist resolvida como JSONL portátil (uma track por linha)"""
+    ensure_directory(manifest_path.parent)
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for index, track in enumerate(tracks):
+            f.write(json.dumps({"index": index, "folder": folder_name, "track": dict(track)},
+                               ensure_ascii=False) + "\n")
+    os.replace(tmp, manifest_path)
+    ensure_directory(manifest_claims_dir(manifest_path))
+    return manifest_path
+
+def read_manifest(manifest_path: Path) -> List[Dict[str, Any]]:
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def manifest_claims_dir(manifest_path: Path) -> Path:
+    return manifest_path.with_name(manifest_path.stem + ".claims")
+
+class ManifestClaims:
+    """Reserva itens do manifesto com arquivos de lock criados com O_EXCL.
+
+    <i>.lock = em andamento, <i>.done = concluído, <i>.failed = falha definitiva.
+    Lock e conclusão usam operações atômicas do sistema de arquivos, sem servidor central.
+    """
+    def __init__(self, manifest_path: Path):
+        self.dir = ensure_directory(manifest_claims_dir(manifest_path))
+        self.owner = f"{platform.node()}:{os.getpid()}"
+
+    def _path(self, index: int, state: str) -> Path:
+        return self.dir / f"{index}.{state}"
+
+    def finished(self, index: int) -> bool:
+        return self._path(index, "done").exists() or self._path(index, "failed").exists()
+
+    def claim(self, index: int) -> bool:
+        if self.finished(index):
+            return False
+        lock = self._path(index, "lock")
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if not self._reclaim_stale(lock):
+                return False
+            return self.claim(index)
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{self.owner} {time.time():.0f}\n")
+        return True
+
+    def _reclaim_stale(self, lock: Path) -> bool:
+        """Remove um lock abandonado; só um worker por vez decide, sob a trava .reclaim.
+
+        Dentro da trava o lock é conferido de novo (mesmo inode e mtime, ainda velho),
+        então um lock recém-criado por outro worker nunca é apagado.
+        """
+        try:
+            seen = lock.stat()
+        except OSError:
+            return True
+        if time.time() - seen.st_mtime < MANIFEST_LOCK_TTL:
+            return False
+        guard = lock.with_name(lock.name + ".reclaim")
+        try:
+            fd = os.open(guard, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - guard.stat().st_mtime > MANIFEST_RECLAIM_TTL:
+                    guard.unlink()
+            except OSError:
+                pass
+            return False
+        except OSError:
+            return False
+        os.close(fd)
+        try:
+            current = lock.stat()
+            if ((current.st_ino, current.st_mtime) != (seen.st_ino, seen.st_mtime)
+                    or time.time() - current.st_mtime < MANIFEST_LOCK_TTL):
+                return False
+            lock.unlink()
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        finally:
+            guard.unlink(missing_ok=True)
+
+    def _owns(self, lock: Path) -> bool:
+        try:
+            return lock.read_text().split(" ", 1)[0] == self.owner
+        except OSError:
+            return False
+
+    @contextmanager
+    def heartbeat(self, index: int):
+        """Renova o mtime do lock enquanto o item é processado"""
+        lock = self._path(index, "lock")
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(MANIFEST_HEARTBEAT):
+                if not self._owns(lock):
+                    break
+                try:
+                    os.utime(lock)
+                except OSError:
+                    break
+
+        thread = threading.Thread(target=beat, daemon=True, name=f"claim-heartbeat-{index}")
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def finish(self, index: int, state: str):
+        """Marca como done/failed renomeando o lock (atômico)"""
+        try:
+            os.replace(self._path(index, "lock"), self._path(index, state))
+        except OSError:
+            self._path(index, state).touch()
+
+    def release(self, index: int):
+        self._path(index, "lock").unlink(missing_ok=True)
+
+    def counts(self, total: int) -> tuple:
+        done = sum(1 for i in range(total) if self._path(i, "done").exists())
+        failed = sum(1 for i in range(total) if self._path(i, "failed").exists())
+        return done, failed
+
+def resolve_spotify_source(url: str, token: str) -> tuple:
+    """Resolve playlist, álbum, track ou artista (discografia) em (pasta, tracks)"""
+    if playlist_id := extract_spotify_playlist_id(url):
+        return f"Spotify_{playlist_id}", get_spotify_playlist_tracks(playlist_id, token)
+    ref = parse_spotify_url(url)
+    if not ref:
+        return None, []
+    kind, spotify_id = ref
+    if kind == "artist":
+        artist = spotify_get(f"{SPOTIFY_API}/artists/{spotify_id}", token)
+        return sanitize_filename(f"Artista_{artist['name']}"), get_spotify_discography(spotify_id, token)
+    return f"Spotify_{spotify_id}", resolve_spotify_urls([url], token).get(url, [])
+
+def manifest_worker(manifest_path: Path, config: Dict[str, Any]):
+    """Processa os itens ainda livres do manifesto, em paralelo com outras máquinas"""
+    entries = read_manifest(manifest_path)
+    claims = ManifestClaims(manifest_path)
+    cookies = COOKIES if COOKIES.exists() else None
+    summary = RunSummary()
+    stage = StagingArea(config)
+    TermuxLogger.info(f"Worker {claims.owner}: {len(entries)} itens no manifesto")
+    processed = 0
+    for entry in entries:
+        index = entry["index"]
+        if not claims.claim(index):
+            continue
+        track = TrackRecord.from_dict(entry["track"])
+        folder = ensure_directory(Path(config["download_dir"]) / entry["folder"])
+        work_folder = stage.folder_for(folder)
+        TermuxLogger.info(f"[{index + 1}/{len(entries)}] {track['search']}")
+        try:
+            with claims.heartbeat(index):
+                if HAS_MUTAGEN and (existing := find_track_file(folder, track, config)):
+                    write_tags(existing, track)
+                    status = "ok"
+                else:
+                    status = download_track(track, work_folder, config, cookies, summary)
+        except BaseException:
+            claims.release(index)
+            raise
+        if status == "ok":
+            stage.add(find_track_file(work_folder, track, config))
+            stage.flush()
+            claims.finish(index, "done")
+        elif status in (Failure.RATE_LIMITED, Failure.STALLED, Failure.NETWORK):
+            # Transitório: libera para outro worker (ou uma próxima rodada) tentar
+            claims.release(index)
+        else:
+            claims.finish(index, "failed")
+        summary.record(status)
+        processed += 1
+    stage.flush(force=True)
+    summary.show(processed)
+    done, failed = claims.counts(len(entries))
+    TermuxLogger.info(f"Manifesto: {done} concluídos, {failed} com falha, "
+                      f"{len(entries) - done - failed} pendentes/em andamento")
+
+def manifest_menu(config: Dict[str, Any]):
+    """Resolver para manifesto ou trabalhar num manifesto compartilhado"""
+    print("1) Resolver para manifesto (sem baixar)")
+    print("2) Worker: baixar itens de um manifesto")
+    choice = input(f"\n{Color.GREEN}▶ {Color.RESET}").strip()
+    if choice == "1":
+        url = input("URL Spotify (playlist/álbum/artista): ").strip()
+        target = input("Arquivo do manifesto (.jsonl): ").strip()
+        if not url or not target:
+            return
+        token = get_spotify_token()
+        if not token:
+            TermuxLogger.error("Não foi possível autenticar no Spotify")
+            return
+        TermuxLogger.info("Resolvendo tracklist...")
+        folder_name, tracks = resolve_spotify_source(url, token)
+        if not tracks:
+            TermuxLogger.error("Nada para exportar!")
+            return
+        path = write_manifest(tracks, folder_name, Path(target).expanduser())
+        TermuxLogger.success(f"Manifesto com {len(tracks)} tracks: {path}")
+        TermuxLogger.info(f"Nas outras máquinas: python RiMusic.py --worker {path}")
+    elif choice == "2":
+        target = input("Arquivo do manifesto (.jsonl): ").strip()
+        if target and Path(target).expanduser().exists():
+            path = Path(target).expanduser()
+            return run_or_enqueue(config, f"Worker: {path.name}", manifest_worker, path, dict(config))
+        else:
+            TermuxLogger.error("Manifesto não encontrado!")
+
+# ---------- JOBS EM SEGUNDO PLANO ----------
+ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+JOB_STATUS = {"queued": "na fila", "running": "rodando", "done": "concluído",
+              "failed": "falhou", "cancelled": "cancelado"}
+
+class Job:
+    """Uma ação do menu rodando no pool compartilhado, com log próprio"""
+    def __init__(self, job_id: int, title: str, func, args: tuple):
+        self.id = job_id
+        self.title = title
+        self.func = func
+        self.args = args
+        self.status = "queued"
+        self.progress: Optional[SmoothProgress] = None
+        self.lines: deque = deque(maxlen=200)
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancelled = threading.Event()
+        self.processes: set = set()
+        self.cleanups: list = []
+
+    def log(self, text: str):
+        self.lines.append(text)
+
+    def kill(self):
+        """Interrompe o job em execução, matando os yt-dlp (e ffmpeg) dele"""
+        self.cancelled.set()
+        for process in list(self.processes):
+            kill_process_tree(process)
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def status_line(self) -> str:
+        """Progresso atual ou, sem ele, a última linha do log"""
+        if self.status == "running" and self.progress and not self.progress.done:
+            text = f"{self.progress.percent:3.0f}% {self.progress.title}"
+        else:
+            text = ANSI_RE.sub("", self.lines[-1]) if self.lines else ""
+        return " ".join(text.split())
+
+class JobScheduler:
+    """Fila única de jobs atendida por um pool de threads compartilhado"""
+    def __init__(self):
+        self.jobs: List[Job] = []
+        self.queue: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.target = 0
+        self.workers = 0
+
+    def resize(self, workers: int):
+        """Ajusta o tamanho do pool; threads extras saem ao terminar o job atual"""
+        with self.lock:
+            self.target = max(1, workers)
+            while self.workers < self.target:
+                self.workers += 1
+                threading.Thread(target=self._worker, name=f"job-worker-{self.workers}", daemon=True).start()
+
+    def submit(self, title: str, func, *args) -> Job:
+        with self.lock:
+            job = Job(len(self.jobs) + 1, title, func, args)
+            self.jobs.append(job)
+        self.queue.put(job)
+        return job
+
+    def active(self) -> List[Job]:
+        return [job for job in self.jobs if job.status in ("queued", "running")]
+
+    def cancel_queued(self):
+        for job in self.jobs:
+            if job.status == "queued":
+                job.status = "cancelled"
+
+    def kill_running(self):
+        for job in self.jobs:
+            if job.status == "running":
+                job.kill()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Espera os jobs ativos terminarem; False se o tempo acabar antes"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.active():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def _worker(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=1)
+            except queue.Empty:
+                job = None
+            if job and job.status == "queued":
+                self._run(job)
+            with self.lock:
+                if self.workers > self.target:
+                    self.workers -= 1
+                    return
+
+    def _run(self, job: Job):
+        set_current_job(job)
+        job.status, job.started = "running", time.monotonic()
+        status = "failed"
+        try:
+            result = job.func(*job.args)
+            status = "failed" if result is False else "done"
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            TermuxLogger.error(f"Erro inesperado: {e}")
+            # Traceback no log do job, não por cima do menu
+            for line in traceback.format_exc().splitlines():
+                job.log(line)
+        finally:
+            for cleanup in job.cleanups:
+                try:
+                    cleanup()
+                except Exception as e:
+                    TermuxLogger.error(f"Erro ao finalizar job: {e}")
+            # Só sai de active() depois da limpeza: quem espera na saída pode confiar nisso
+            job.finished, job.status = time.monotonic(), status
+            set_current_job(None)
+
+JOBS = JobScheduler()
+
+def run_or_enqueue(config: Dict[str, Any], title: str, func, *args) -> Optional[Job]:
+    """Enfileira a ação (modo segundo plano) ou roda agora; retorna o Job ou None"""
+    if not config.get("background_jobs"):
+        func(*args)
+        return None
+    JOBS.resize(config.get("job_workers", 2))
+    job = JOBS.submit(title, func, *args)
+    TermuxLogger.success(f"Job #{job.id} na fila: {title} (acompanhe em 9) Jobs)")
+    return job
+
+def jobs_screen():
+    """Status ao vivo dos jobs; número + Enter mostra o log do job"""
+    selected = None
+    while True:
+        show_banner()
+        print(f"{Color.BOLD}--- JOBS ({len(JOBS.active())} ativos) ---{Color.RESET}\n")
+        if not JOBS.jobs:
+            print("Nenhum job ainda.")
+        for job in JOBS.jobs[-15:]:
+            color = {"running": Color.CYAN, "done": Color.GREEN, "failed": Color.RED}.get(job.status, Color.YELLOW)
+            print(f"#{job.id:<3} {color}{JOB_STATUS[job.status]:<10}{Color.RESET} {job.elapsed:6.0f}s  {job.title[:40]}")
+            if job.status == "running":
+                print(f"      {job.status_line()[:60]}")
+        if selected:
+            print(f"\n{Color.BOLD}Log do job #{selected.id}:{Color.RESET}")
+            for line in list(selected.lines)[-12:]:
+                print(f"  {line}")
+        print(f"\n{Color.CYAN}Número + Enter: ver log · Enter: voltar{Color.RESET}")
+        # Atualiza a cada segundo sem bloquear na leitura
+        ready, _, _ = select.select([sys.stdin], [], [], 1)
+        if not ready:
+            continue
+        choice = sys.stdin.readline().strip()
+        if not choice:
+            break
+        if choice.isdigit() and 1 <= int(choice) <= len(JOBS.jobs):
+            selected = JOBS.jobs[int(choice) - 1]
+
 # ---------- INTERFACE DE USUÁRIO ----------
 def clear_screen():
     """Limpa a tela do terminal"""
@@ -539,11 +2622,21 @@ def settings_menu(config: Dict[str, Any]):
             ("Qualidade áudio", config["audio_quality"]),
             ("Tick (segundos)", config["tick"]),
             ("Diretório", config["download_dir"]),
-            ("Cookies", "✓" if COOKIES.exists() else "✗")
+            ("Cookies", "✓" if COOKIES.exists() else "✗"),
+            ("Tocar ao baixar", "✓" if config.get("stream_play") else "✗"),
+            ("Workers playlist", config["playlist_workers"]),
+            ("Backend vídeo", f"{config['video_backend']} ({config['segments']} conexões)"
+             if config["video_backend"] == "segmented" else config["video_backend"]),
+            ("Watchdog", f"{config['stall_timeout']}s parado / {config['job_budget']}s por job"),
+            ("Formato inteligente", "✓" if config.get("smart_format") else "✗"),
+            ("Staging interno", "✓" if config.get("staging") else "✗"),
+            ("Trace (timeline)", "✓" if config.get("trace") else "✗"),
+            ("Jobs em 2º plano", f"✓ ({config['job_workers']} simultâneos)" if config.get("background_jobs") else "✗")
         ]
+        restore = str(len(settings) + 1)
         for i, (name, value) in enumerate(settings, 1):
             print(f"{i}) {name:<18} → {value}")
-        print(f"\n7) Restaurar padrões")
+        print(f"\n{restore}) Restaurar padrões")
         print(f"0) Voltar")
         choice = input(f"\n{Color.GREEN}▶ {Color.RESET}").strip()
         if choice == "1":
@@ -574,6 +2667,58 @@ def settings_menu(config: Dict[str, Any]):
         elif choice == "6":
             manage_cookies()
         elif choice == "7":
+            config["stream_play"] = not config.get("stream_play")
+            if config["stream_play"]:
+                player = input("Player (auto/mpv/ffplay/termux-media-player): ").strip().lower()
+                if player in ["auto", "mpv", "ffplay", "termux-media-player"]:
+                    config["player"] = player
+            save_config(config)
+        elif choice == "8":
+            new_workers = input("Downloads paralelos por playlist (1-16): ").strip()
+            if new_workers.isdigit() and 1 <= int(new_workers) <= 16:
+                config["playlist_workers"] = int(new_workers)
+                save_config(config)
+        elif choice == "9":
+            new_backend = input("Backend de vídeo (ytdlp/segmented): ").strip().lower()
+            if new_backend in ["ytdlp", "segmented"]:
+                config["video_backend"] = new_backend
+                if new_backend == "segmented":
+                    new_segments = input("Conexões por arquivo (1-16): ").strip()
+                    if new_segments.isdigit() and 1 <= int(new_segments) <= 16:
+                        config["segments"] = int(new_segments)
+                save_config(config)
+            bench_url = input("URL para benchmark (Enter para pular): ").strip()
+            if bench_url:
+                benchmark_video_backends(bench_url, config, COOKIES if COOKIES.exists() else None)
+                input(f"\n{Color.CYAN}Enter para continuar...{Color.RESET}")
+        elif choice == "10":
+            new_stall = input("Segundos sem progresso até reiniciar (0=desligado): ").strip()
+            new_budget = input("Tempo máximo por job em segundos (0=sem limite): ").strip()
+            if new_stall.isdigit() and new_budget.isdigit():
+                config["stall_timeout"] = int(new_stall)
+                config["job_budget"] = int(new_budget)
+                save_config(config)
+        elif choice == "11":
+            config["smart_format"] = not config.get("smart_format")
+            save_config(config)
+        elif choice == "12":
+            config["staging"] = not config.get("staging")
+            save_config(config)
+        elif choice == "13":
+            config["trace"] = not config.get("trace")
+            save_config(config)
+            if config["trace"]:
+                TRACER.enable()
+                TermuxLogger.info(f"Trace gravado em {TRACE_DIR} ao sair (abra em ui.perfetto.dev)")
+        elif choice == "14":
+            config["background_jobs"] = not config.get("background_jobs")
+            if config["background_jobs"]:
+                new_workers = input("Jobs simultâneos (1-8): ").strip()
+                if new_workers.isdigit() and 1 <= int(new_workers) <= 8:
+                    config["job_workers"] = int(new_workers)
+                    JOBS.resize(config["job_workers"])
+            save_config(config)
+        elif choice == restore:
             config.update(DEFAULT_CONFIG)
             save_config(config)
             TermuxLogger.success("Configurações restauradas!")
@@ -611,6 +2756,9 @@ def main_menu() -> str:
         "4) URL direta",
         "5) Configurações",
         "6) Sobre",
+        "7) Discografia do artista",
+        "8) Manifesto (multi-dispositivo)",
+        f"9) Jobs ({len(JOBS.active())} ativos)",
         "0) Sair"
     ]
     for item in menu_items:
@@ -622,22 +2770,42 @@ def single_download(config: Dict[str, Any]):
     """Download único por nome"""
     query = input("Nome da música/artista: ").strip()
     if not query:
-        return
+        return None
+    if config.get("stream_play"):
+        # A reprodução usa o terminal: fica em primeiro plano
+        return download_single(query, config)
+    return run_or_enqueue(config, f"Música: {query}", download_single, query, dict(config))
+
+def download_single(query: str, config: Dict[str, Any]) -> bool:
+    """Busca a música no Spotify e baixa com os metadados"""
     folder = ensure_directory(Path(config["download_dir"]) / "Singles")
     cookies = COOKIES if COOKIES.exists() else None
     token = get_spotify_token()
     if not token:
         TermuxLogger.error("Não foi possível autenticar no Spotify")
-        return
+        return False
     metadata = search_spotify_track(query, token)
     if metadata:
-        success = download_with_metadata(metadata, folder, config, cookies)
+        if config.get("stream_play"):
+            path = stream_download("ytsearch1:" + metadata["search"], folder, config,
+                                   cookies, name=metadata["search"])
+            if path:
+                write_tags(path, metadata)
+            success = path is not None
+        else:
+            stage = StagingArea(config)
+            work_folder = stage.folder_for(folder)
+            success = download_with_metadata(metadata, work_folder, config, cookies)
+            if success:
+                stage.add(find_track_file(work_folder, metadata, config))
+                stage.flush(force=True)
         if success:
             TermuxLogger.success("Download concluído!")
         else:
             TermuxLogger.error("Falha no download!")
-    else:
-        TermuxLogger.error("Música não encontrada no Spotify")
+        return success
+    TermuxLogger.error("Música não encontrada no Spotify")
+    return False
 
 def spotify_playlist_download(config: Dict[str, Any]):
     """Download de playlist do Spotify"""
@@ -647,82 +2815,219 @@ def spotify_playlist_download(config: Dict[str, Any]):
     playlist_id = extract_spotify_playlist_id(url)
     if not playlist_id:
         TermuxLogger.error("URL da playlist inválida!")
-        return
+        return None
+    return run_or_enqueue(config, f"Playlist {playlist_id}", download_spotify_playlist, playlist_id, dict(config))
+
+def download_spotify_playlist(playlist_id: str, config: Dict[str, Any]) -> bool:
+    """Resolve as tracks da playlist e baixa todas"""
     token = get_spotify_token()
     if not token:
         TermuxLogger.error("Não foi possível autenticar no Spotify")
-        return
+        return False
     TermuxLogger.info("Obtendo tracks da playlist...")
     tracks = get_spotify_playlist_tracks(playlist_id, token)
     if not tracks:
         TermuxLogger.error("Playlist vazia ou não acessível!")
-        return
+        return False
     folder = ensure_directory(Path(config["download_dir"]) / f"Spotify_{playlist_id}")
+    download_track_list(tracks, folder, config)
+
+def download_track_list(tracks: List[Dict[str, Any]], folder: Path, config: Dict[str, Any]):
+    """Baixa uma lista de tracks já resolvidas com metadados do Spotify"""
     cookies = COOKIES if COOKIES.exists() else None
-    TermuxLogger.info(f"Baixando {len(tracks)} músicas...")
-    success_count = 0
-    for i, track in enumerate(tracks, 1):
-        TermuxLogger.info(f"{i}/{len(tracks)}: {track['search']}")
-        if download_with_metadata(track, folder, config, cookies):
-            success_count += 1
-    TermuxLogger.success(f"Concluído: {success_count}/{len(tracks)} músicas")
+    summary = RunSummary()
+    stage = StagingArea(config)
+    work_folder = stage.folder_for(folder)
+    missing = retag_existing(tracks, folder, config)
+    for _ in range(len(tracks) - len(missing)):
+        summary.record("ok")
+    TermuxLogger.info(f"Baixando {len(missing)} músicas...")
+    pending = deque((track, 0) for track in missing)
+    done = 0
+    while pending:
+        track, requeues = pending.popleft()
+        if requeues:
+            TermuxLogger.info(f"Reenfileirada ({requeues}x): {track['search']}")
+        else:
+            done += 1
+            TermuxLogger.info(f"{done}/{len(missing)}: {track['search']}")
+        status = download_track(track, work_folder, config, cookies, summary)
+        if status == "ok":
+            stage.add(find_track_file(work_folder, track, config))
+            stage.flush()
+        if status in (Failure.RATE_LIMITED, Failure.STALLED) and requeues < REQUEUE_LIMIT:
+            # Vai para o fim da fila; se só restarem reenfileiradas por limite, espera passar
+            pending.append((track, requeues + 1))
+            if status == Failure.RATE_LIMITED and all(count for _, count in pending):
+                TermuxLogger.warning(f"Limite de taxa, aguardando {RATE_LIMIT_COOLDOWN:.0f}s...")
+                TRACER.sleep(RATE_LIMIT_COOLDOWN, "rate limit")
+            continue
+        summary.record(status)
+    stage.flush(force=True)
+    summary.show(len(tracks))
+    stage.report()
+
+def discography_download(config: Dict[str, Any]):
+    """Download da discografia completa de um artista"""
+    url = input("URL ou ID do artista no Spotify: ").strip()
+    if not url:
+        return
+    ref = parse_spotify_url(url)
+    if ref and ref[0] == "artist":
+        artist_id = ref[1]
+    elif re.fullmatch(r'[a-zA-Z0-9]{22}', url):
+        artist_id = url
+    else:
+        TermuxLogger.error("URL do artista inválida!")
+        return None
+    return run_or_enqueue(config, f"Discografia {artist_id}", download_discography, artist_id, dict(config))
+
+def download_discography(artist_id: str, config: Dict[str, Any]) -> bool:
+    """Resolve a discografia (sem duplicatas) e baixa todas as tracks"""
+    token = get_spotify_token()
+    if not token:
+        TermuxLogger.error("Não foi possível autenticar no Spotify")
+        return False
+    try:
+        artist = spotify_get(f"{SPOTIFY_API}/artists/{artist_id}", token)
+        TermuxLogger.info(f"Obtendo discografia de {artist['name']}...")
+        started = time.monotonic()
+        tracks = get_spotify_discography(artist_id, token)
+    except Exception as e:
+        TermuxLogger.error(f"Erro ao obter discografia: {e}")
+        return False
+    if not tracks:
+        TermuxLogger.error("Nenhuma música encontrada!")
+        return False
+    TermuxLogger.success(f"{len(tracks)} músicas únicas resolvidas em {time.monotonic() - started:.1f}s")
+    folder = ensure_directory(Path(config["download_dir"]) / sanitize_filename(f"Artista_{artist['name']}"))
+    download_track_list(tracks, folder, config)
 
 def text_file_download(config: Dict[str, Any]):
     """Download a partir de arquivo de texto"""
     file_path = input("Caminho do arquivo .txt: ").strip()
     if not file_path:
-        return
+        return None
     txt_file = Path(file_path)
     if not txt_file.exists():
         TermuxLogger.error("Arquivo não encontrado!")
-        return
+        return None
+    return run_or_enqueue(config, f"Lista: {txt_file.name}", download_text_file, txt_file, dict(config))
+
+def download_text_file(txt_file: Path, config: Dict[str, Any]) -> bool:
+    """Baixa cada linha do arquivo: link do Spotify, URL ou busca por nome"""
     try:
         with open(txt_file, 'r', encoding='utf-8') as f:
             items = [line.strip() for line in f if line.strip()]
     except Exception as e:
         TermuxLogger.error(f"Erro ao ler arquivo: {e}")
-        return
+        return False
     if not items:
         TermuxLogger.warning("Arquivo vazio!")
-        return
+        return False
     folder = ensure_directory(Path(config["download_dir"]) / sanitize_filename(txt_file.stem))
     cookies = COOKIES if COOKIES.exists() else None
     token = get_spotify_token()
-    TermuxLogger.info(f"Processando {len(items)} itens...")
+    spotify_items = {}
+    if token and any(parse_spotify_url(item) for item in items):
+        TermuxLogger.info("Resolvendo links do Spotify em lote...")
+        spotify_items = resolve_spotify_urls(items, token)
+    total = sum(len(spotify_items[item]) if item in spotify_items else 1 for item in items)
+    TermuxLogger.info(f"Processando {len(items)} itens ({total} downloads)...")
+    stage = StagingArea(config)
+    work_folder = stage.folder_for(folder)
+    job_config = stage.job_config(config)
+
+    def download_metadata(metadata: Dict[str, Any]) -> bool:
+        if download_with_metadata(metadata, work_folder, config, cookies):
+            stage.add(find_track_file(work_folder, metadata, config))
+            return True
+        return False
+
     success_count = 0
     for i, item in enumerate(items, 1):
         TermuxLogger.info(f"Item {i}/{len(items)}: {item}")
+        if item in spotify_items:
+            if not spotify_items[item]:
+                TermuxLogger.error(f"Link do Spotify não resolvido: {item}")
+            for metadata in spotify_items[item]:
+                if download_metadata(metadata):
+                    success_count += 1
+            continue
         if token and not item.startswith(('http://', 'https://')):
             metadata = search_spotify_track(item, token)
             if metadata:
-                if download_with_metadata(metadata, folder, config, cookies):
+                if download_metadata(metadata):
                     success_count += 1
                 continue
         if item.startswith(('http://', 'https://')):
-            if download_from_url(item, folder, config, cookies):
+            if download_from_url(item, work_folder, job_config, cookies):
                 success_count += 1
         else:
             search_url = f"ytsearch1:{item}"
-            if download_from_url(search_url, folder, config, cookies):
+            if download_from_url(search_url, work_folder, job_config, cookies):
                 success_count += 1
-    TermuxLogger.success(f"Concluído: {success_count}/{len(items)}")
+        stage.flush()
+    stage.flush(force=True)
+    TermuxLogger.success(f"Concluído: {success_count}/{total}")
+    stage.report()
 
 def url_download(config: Dict[str, Any]):
     """Download por URL direta"""
     url = input("URL do vídeo/áudio: ").strip()
     if not url:
-        return
+        return None
+    if config.get("stream_play") and "list=" not in url:
+        return download_url(url, config)
+    return run_or_enqueue(config, f"URL: {url}", download_url, url, dict(config))
+
+def download_url(url: str, config: Dict[str, Any]) -> bool:
+    """Baixa uma URL (vídeo, áudio ou playlist)"""
     folder = ensure_directory(Path(config["download_dir"]) / "URLs")
     cookies = COOKIES if COOKIES.exists() else None
-    success = download_from_url(url, folder, config, cookies)
+    if config.get("stream_play") and "list=" not in url:
+        success = stream_download(url, folder, config, cookies) is not None
+    else:
+        stage = StagingArea(config)
+        success = download_from_url(url, stage.folder_for(folder), stage.job_config(config), cookies)
+        stage.flush(force=True)
     if success:
         TermuxLogger.success("Download concluído!")
     else:
         TermuxLogger.error("Falha no download!")
+    return success
 
 # ---------- LOOP PRINCIPAL ----------
+JOB_KILL_GRACE = 15  # segundos para os jobs interrompidos limparem (staging, claims)
+
+def confirm_exit() -> bool:
+    """Confirma a saída com jobs ativos e encerra-os; False se o usuário desistir.
+
+    Os da fila são descartados e os que estão rodando terminam antes de sair.
+    Ctrl+C na pergunta ou durante a espera interrompe os jobs em execução.
+    """
+    active = JOBS.active()
+    if not active:
+        return True
+    try:
+        if not input(f"\n{len(active)} jobs ativos. Sair mesmo assim? (s/n): ").strip().lower().startswith('s'):
+            return False
+        JOBS.cancel_queued()
+        TermuxLogger.info("Aguardando jobs em execução... (Ctrl+C para interromper)")
+        JOBS.wait()
+    except (KeyboardInterrupt, EOFError):
+        JOBS.cancel_queued()
+        TermuxLogger.warning("\nInterrompendo jobs em execução...")
+        JOBS.kill_running()
+        if not JOBS.wait(JOB_KILL_GRACE):
+            TermuxLogger.warning("Alguns jobs não terminaram a tempo")
+    return True
+
 def main():
     """Função principal"""
+    if sys.argv[1:] == ["--bench-memory"]:
+        benchmark_track_memory()
+        return
     try:
         if not check_dependencies():
             sys.exit(1)
@@ -730,36 +3035,63 @@ def main():
         ensure_directory(Path(config["download_dir"]))
         if not COOKIES.exists():
             COOKIES.touch()
+        if config.get("trace") or os.environ.get("RIMUSIC_TRACE"):
+            TRACER.enable()
+        if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+            manifest_worker(Path(sys.argv[2]).expanduser(), config)
+            return
         TermuxLogger.success("RiMusic iniciado no Termux!")
         while True:
             try:
                 choice = main_menu()
+                result = None
                 if choice == "1":
-                    single_download(config)
+                    result = single_download(config)
                 elif choice == "2":
-                    spotify_playlist_download(config)
+                    result = spotify_playlist_download(config)
                 elif choice == "3":
-                    text_file_download(config)
+                    result = text_file_download(config)
                 elif choice == "4":
-                    url_download(config)
+                    result = url_download(config)
                 elif choice == "5":
                     settings_menu(config)
                 elif choice == "6":
                     about_screen()
+                elif choice == "7":
+                    result = discography_download(config)
+                elif choice == "8":
+                    result = manifest_menu(config)
+                elif choice == "9":
+                    jobs_screen()
+                    continue
                 elif choice == "0":
+                    if not confirm_exit():
+                        continue
                     TermuxLogger.success("Até logo! 👋")
                     break
                 else:
                     TermuxLogger.error("Opção inválida!")
+                if isinstance(result, Job):
+                    # Job enfileirado: volta direto ao menu
+                    time.sleep(0.8)
+                    continue
                 input(f"\n{Color.CYAN}Enter para continuar...{Color.RESET}")
             except KeyboardInterrupt:
                 TermuxLogger.warning("\nInterrompido pelo usuário")
-                break
+                if confirm_exit():
+                    break
     except KeyboardInterrupt:
         TermuxLogger.warning("\nInterrompido pelo usuário")
     except Exception as e:
         TermuxLogger.error(f"Erro inesperado: {e}")
         logger.exception("Erro detalhado:")
+    finally:
+        # Saída por erro com jobs rodando: não deixa yt-dlp órfãos (start_new_session)
+        JOBS.cancel_queued()
+        JOBS.kill_running()
+        JOBS.wait(JOB_KILL_GRACE)
+        if trace_path := TRACER.save():
+            TermuxLogger.info(f"Trace salvo: {trace_path} (abra em ui.perfetto.dev)")
 
 if __name__ == "__main__":
     main()
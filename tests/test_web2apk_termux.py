@@ -0,0 +1,224 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web2apk_termux as w2a
+
+
+class StandIn:
+    """Servidor HTTP local que responde rotas fixas: {caminho: (atraso, status, tipo, corpo)}"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.aborted = threading.Event()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self):
+                stand_in.requests.append(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                delay, status, content_type, body = stand_in.routes.get(
+                    self.path, (0, 404, "text/plain", b"not found"))
+                time.sleep(delay)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    stand_in.aborted.set()
+
+            do_GET = do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def json_route(payload, delay=0, status=200):
+    return (delay, status, "application/json", json.dumps(payload).encode())
+
+
+class CloudServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stats_path = Path(self.tmp.name) / "backends.json"
+        self.servers = []
+        backends = mock.patch.dict(w2a.CLOUD_BACKENDS, clear=True)
+        backends.start()
+        self.addCleanup(backends.stop)
+        real_stats = w2a.BackendStats
+        stats = mock.patch.object(w2a, "BackendStats", lambda: real_stats(self.stats_path))
+        stats.start()
+        self.addCleanup(stats.stop)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+        self.tmp.cleanup()
+
+    def backend(self, name, route):
+        server = StandIn({"/build": route})
+        self.servers.append(server)
+        w2a.register_backend(w2a.CloudBackend(
+            name, server.url + "/build",
+            lambda url, app_name: {"url": url, "name": app_name},
+            lambda result: result.get("apk_url")))
+        return server
+
+    def run_service(self, timeout=10):
+        started = time.monotonic()
+        with redirect_stdout(io.StringIO()):
+            apk_url = w2a.TermuxWebToAPK().use_cloud_service("https://example.org", "Demo", timeout)
+        return apk_url, time.monotonic() - started
+
+    def stats(self):
+        return json.loads(self.stats_path.read_text())
+
+    def test_fastest_backend_wins_and_slow_one_is_cancelled(self):
+        self.backend("fast", json_route({"apk_url": "https://cdn/fast.apk"}, delay=0.1))
+        slow = self.backend("slow", json_route({"apk_url": "https://cdn/slow.apk"}, delay=3))
+        apk_url, elapsed = self.run_service()
+        self.assertEqual(apk_url, "https://cdn/fast.apk")
+        self.assertLess(elapsed, 2)
+        # A conexão do perdedor foi derrubada: a resposta dele não tem para onde ir
+        self.assertTrue(slow.aborted.wait(5))
+        stats = self.stats()
+        self.assertEqual(stats["fast"]["successes"], 1)
+        self.assertNotIn("slow", stats)
+
+    def test_failing_backend_falls_through_to_next(self):
+        self.backend("broken", json_route({"error": "boom"}, status=500))
+        self.backend("good", json_route({"apk_url": "https://cdn/good.apk"}, delay=0.3))
+        apk_url, _ = self.run_service()
+        self.assertEqual(apk_url, "https://cdn/good.apk")
+        stats = self.stats()
+        self.assertEqual((stats["broken"]["attempts"], stats["broken"]["successes"]), (1, 0))
+        self.assertEqual((stats["good"]["attempts"], stats["good"]["successes"]), (1, 1))
+
+    def test_every_completed_attempt_is_recorded(self):
+        self.backend("a", json_route({"apk_url": None}, delay=0.1))
+        self.backend("b", json_route({"apk_url": None}, delay=0.4))
+        apk_url, _ = self.run_service()
+        self.assertIsNone(apk_url)
+        stats = self.stats()
+        self.assertEqual(stats["a"]["attempts"], 1)
+        self.assertEqual(stats["b"]["attempts"], 1)
+        self.assertGreater(stats["b"]["latency"], stats["a"]["latency"])
+
+    def test_history_orders_backends(self):
+        slow = self.backend("slow", json_route({"apk_url": "https://cdn/slow.apk"}, delay=0.5))
+        self.backend("fast", json_route({"apk_url": "https://cdn/fast.apk"}, delay=0.05))
+        self.stats_path.write_text(json.dumps({
+            "slow": {"attempts": 4, "successes": 4, "latency": 5.0},
+            "fast": {"attempts": 4, "successes": 4, "latency": 0.05},
+        }))
+        apk_url, _ = self.run_service()
+        self.assertEqual(apk_url, "https://cdn/fast.apk")
+        # O histórico manda esperar o rápido antes de disparar o lento (hedge)
+        self.assertEqual(slow.requests, [])
+
+
+class SiteCrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = Path(self.tmp.name) / "site" / "App_PWA"
+        self.output.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_local_path_stays_inside_crawl_dir(self):
+        crawler = w2a.SiteCrawler("http://host/", self.output)
+        for url, expected in [
+            ("http://host/", "offline/host/index.html"),
+            ("http://host/../../../../../escaped.css", "offline/host/escaped.css"),
+            ("http://host/a/../../b/", "offline/host/b/index.html"),
+            ("http://host/..\\..\\x.css", "offline/host/x.css"),
+            ("http://host:8080/app.js", "offline/host_8080/app.js"),
+            ("http://../x.js", "offline/_/x.js"),
+        ]:
+            self.assertEqual(crawler.local_path(url), expected, url)
+
+    def test_crawl_does_not_write_outside_output_dir(self):
+        css = (0, 200, "text/css", b"body{color:red}")
+        server = StandIn({})
+        self.addCleanup(server.close)
+        escaped = server.url + "/../../../../../escaped.css"
+        server.routes.update({
+            "/": (0, 200, "text/html", f'<link rel="stylesheet" href="{escaped}">'.encode()),
+            "/escaped.css": css,
+            "/../../../../../escaped.css": css,
+        })
+        with redirect_stdout(io.StringIO()):
+            start = w2a.SiteCrawler(server.url + "/", self.output).run()
+        written = sorted(p.relative_to(self.tmp.name).as_posix()
+                         for p in Path(self.tmp.name).rglob("*") if p.is_file())
+        host = "127.0.0.1_%d" % server.server.server_port
+        self.assertEqual(written, [f"site/App_PWA/offline/{host}/escaped.css",
+                                   f"site/App_PWA/offline/{host}/index.html"])
+        page = (self.output / start).read_text()
+        self.assertIn('href="escaped.css"', page)
+
+    def test_pages_without_extension_nest_as_index_html(self):
+        html = lambda text: (0, 200, "text/html; charset=utf-8", text.encode())
+        server = StandIn({
+            "/": html('<a href="/docs">Docs</a> <a href="/docs/intro">Intro</a>'),
+            "/docs": html('<link rel="stylesheet" href="/docs/app.css"><a href="docs/intro">Intro</a>'),
+            "/docs/intro": html('<link rel="stylesheet" href="/docs/app.css"><a href="/docs">Docs</a>'),
+            "/docs/app.css": (0, 200, "text/css", b"body{margin:0}"),
+        })
+        self.addCleanup(server.close)
+        with redirect_stdout(io.StringIO()):
+            start = w2a.SiteCrawler(server.url + "/", self.output, depth=1).run()
+        site = self.output / "offline" / ("127.0.0.1_%d" % server.server.server_port)
+        written = sorted(p.relative_to(site).as_posix() for p in site.rglob("*") if p.is_file())
+        self.assertEqual(written, ["docs/app.css", "docs/index.html", "docs/intro/index.html", "index.html"])
+        self.assertIn('href="docs/index.html"', (self.output / start).read_text())
+        self.assertIn('href="docs/intro/index.html"', (self.output / start).read_text())
+        docs = (site / "docs" / "index.html").read_text()
+        self.assertIn('href="app.css"', docs)
+        self.assertIn('href="intro/index.html"', docs)
+        intro = (site / "docs" / "intro" / "index.html").read_text()
+        self.assertIn('href="../app.css"', intro)
+        self.assertIn('href="../index.html"', intro)
+
+    def test_unwritable_file_is_skipped(self):
+        server = StandIn({
+            "/": (0, 200, "text/html", b'<img src="/img"><img src="/img/a.png">'),
+            "/img": (0, 200, "image/png", b"png"),
+            "/img/a.png": (0, 200, "image/png", b"png"),
+        })
+        self.addCleanup(server.close)
+        with redirect_stdout(io.StringIO()) as out:
+            start = w2a.SiteCrawler(server.url + "/", self.output).run()
+        self.assertTrue((self.output / start).exists())
+        self.assertIn("Não foi possível salvar", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()